@@ -1,21 +1,60 @@
 # -*- coding: utf-8 -*-
 
-import re
+import calendar
+import datetime
+import os
+import threading
+import urllib
 import xml.etree.ElementTree as ET
+from collections import deque
+from contextlib import closing
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
-from apiclient import discovery
 from apiclient import errors
+from apiclient.http import BatchHttpRequest
 from apiclient.http import MediaFileUpload
+from oauth2client.client import AccessTokenRefreshError
 from oauth2client.client import OAuth2Credentials
-import httplib2
 
-from django.template import Context
-from django.template.loader import get_template
-
-from utils import get_xml_ns
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.encoding import force_str
+
+from atom import ATOM_ID
+from atom import cells_feed
+from atom import FEEDS_URL
+from atom import iter_worksheets
+from atom import worksheet_entry
+from cache import LRUCache
+from cache import MetadataCache
+from pool import build_service
+from pool import open_stream
+from pool import PooledHttp
+from scheduler import get_scheduler
+from scheduler import IDEMPOTENT_METHODS
+from sheets import bounds
+from sheets import CellCache
+from sheets import CellResult
+from sheets import parse_batch_response
+from sheets import WorksheetIndex
+from upload import CHUNKSIZE
+from upload import resumable_execute
+from upload import session_key
+from utils import prefetch as prefetch_iter
+
+
+SESSION_KEY = 'gdrive_oauth_credentials'
+metadata_cache = MetadataCache(getattr(settings, 'GDRIVE_METADATA_CACHE', 'default'))
+DOWNLOAD_CHUNKSIZE = getattr(settings, 'GDRIVE_DOWNLOAD_CHUNKSIZE', 1024 * 1024)
+# the projection of listed files, None lists full file resources
+FILE_FIELDS = getattr(settings, 'GDRIVE_FILE_FIELDS',
+                      'id,etag,title,description,mimeType,parents(id),modifiedDate,'
+                      'fileSize,md5Checksum,downloadUrl,exportLinks,labels/trashed')
 
 
 class IdMixin(object):
+    __slots__ = ()
     __id = None
 
     def get_id(self):
@@ -35,35 +74,231 @@ class GError(Exception):
     pass
 
 
+def is_not_modified(error, cached):
+    return (cached is not None and isinstance(error, errors.HttpError) and
+            error.resp.status == 304)
+
+
+class GResult(object):
+
+    ''' Future-like handle of a call queued by GDrive.batch()
+        -----------------------------------------------------
+
+    Resolves to the G<FileType> object (or raw response), or to GError,
+    once the batch is sent.
+    '''
+
+    def __init__(self):
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def done(self):
+        return self._done
+
+    def exception(self):
+        self._check()
+        return self._error
+
+    def result(self):
+        self._check()
+
+        if self._error is not None:
+            raise self._error
+
+        return self._value
+
+    def set_result(self, value):
+        self._value = value
+        self._done = True
+
+    def set_exception(self, error):
+        self._error = error
+        self._done = True
+
+    def _check(self):
+
+        if not self._done:
+            raise GError('The batch has not been sent yet.')
+
+
+class GBatch(object):
+
+    ''' Queue of Drive API calls sent as multipart batch requests
+        ---------------------------------------------------------
+
+    Read more:
+        https://developers.google.com/drive/v2/web/batch
+    '''
+
+    max_size = 100
+
+    def __init__(self, gdrive, size=None):
+        self.gdrive = gdrive
+        self.size = min(size or self.max_size, self.max_size)
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, request, wrap=None, cached=None):
+        if request.resumable is not None:
+            # media uploads can not be batched, send it right now
+            return self.gdrive.upload(request, wrap=wrap)
+
+        result = GResult()
+        self._queue += [(request, wrap, cached, result)]
+
+        if len(self._queue) >= self.size:
+            self.flush()
+
+        return result
+
+    def flush(self):
+        queue, self._queue = self._queue, []
+        scheduler = self.gdrive.scheduler
+        attempt = 0
+
+        while queue:
+            handles = {}
+            retry = []
+
+            def callback(request_id, response, exception):
+                request, wrap, cached, result = handles[request_id]
+
+                if exception is None or is_not_modified(exception, cached):
+
+                    if exception is not None:
+                        response = cached
+
+                    try:
+                        result.set_result(self.gdrive._wrap(response, wrap))
+                    except GError, error:
+                        result.set_exception(error)
+
+                elif (attempt < scheduler.max_retries and
+                      isinstance(exception, errors.HttpError) and
+                      scheduler.is_retryable(exception)):
+                    scheduler.count('retries')
+                    retry.append((request, wrap, cached, result))
+
+                else:
+                    scheduler.count('failures')
+                    result.set_exception(GError(exception))
+
+            batch = BatchHttpRequest(callback=callback, batch_uri=self.gdrive.batch_uri)
+
+            for i, item in enumerate(queue):
+                handles[str(i)] = item
+                batch.add(item[0], request_id=str(i))
+
+            try:
+                scheduler.call(lambda: batch.execute(http=self.gdrive.http), self.gdrive.user_key)
+            except (errors.HttpError, errors.BatchError), error:
+                for request, wrap, cached, result in handles.itervalues():
+
+                    if not result.done():
+                        result.set_exception(GError(error))
+
+                return
+
+            # rate limited calls of the batch are sent again by the next one
+            queue = retry
+
+            if queue:
+                scheduler.backoff(attempt)
+                attempt += 1
+
+    def abort(self, reason='The batch was aborted.'):
+        queue, self._queue = self._queue, []
+
+        for request, wrap, cached, result in queue:
+            result.set_exception(GError(reason))
+
+
+class Field(object):
+
+    ''' Attribute of GFileBase, decoded from the API item on first read
+        ---------------------------------------------------------------
+
+    Nothing is copied out of the item on init, assigned values are kept
+    apart, so get_raw() stays the response as it was.
+
+    Arguments:
+        key: key of the item.
+        default: value or callable, which makes the value, if the key is
+            absent, e.g. list for a new list of every object.
+    '''
+
+    def __init__(self, key, default=None):
+        self.key = key
+        self.default = default
+
+    def __get__(self, obj, cls):
+
+        if obj is None:
+            return self
+
+        if obj._changes is not None and self.key in obj._changes:
+            return obj._changes[self.key]
+
+        if self.key in obj._raw:
+            return obj._raw[self.key]
+
+        if not callable(self.default):
+            return self.default
+
+        # a new mutable default must outlive this call
+        value = self.default()
+        self.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+
+        if obj._changes is None:
+            obj._changes = {}
+
+        obj._changes[self.key] = value
+
+
 class GFileBase(IdMixin):
-    # TODO: tests with uploading a file
-    mime_type = None
-    file_mime_type = None
-    file_id = None
-    filename = None
-    convert = False
-    parents = []
-    title = None
-    description = None
+
+    ''' Base of G<FileType> objects
+        ---------------------------
+
+    Attributes of the file resource are Field descriptors over the API
+    item. Parameters of an upload are local, they are kept in slots:
+        filename: local file to upload.
+        file_mime_type: mime type of the local file.
+        chunksize: bytes sent by a single request of the upload.
+
+    The classes declare __slots__, so an attribute, which is neither a field
+    nor a slot, can not be set on an object and raises AttributeError.
+    '''
+
+    __slots__ = ('gdrive', '_id', '_raw', '_changes',
+                 'file_id', 'filename', 'file_mime_type', 'chunksize')
+
+    mime_type = Field('mimeType')
+    convert = Field('convert', False)
+    parents = Field('parents', list)
+    title = Field('title')
+    description = Field('description')
 
     def __init__(self, gdrive, item):
         self.gdrive = gdrive
         self._raw = item
         self._id = item.get('id', None)
+        self._changes = None
+        self.file_id = None
         self.filename = item.get('filename', None)
-        self.convert = item.get('convert', False)
-        self.parents = item.get('parents', [])
-        self.title = item.get('title', None)
-        self.description = item.get('description', None)
-
-        if self.mime_type is None:
-            self.mime_type = item.get('mimeType', None)
-            self.file_mime_type = item.get('fileMimeType', None)
+        self.file_mime_type = item.get('fileMimeType', None)
+        self.chunksize = CHUNKSIZE
 
     def get_raw(self):
         return self._raw
 
-    def save(self):
+    def save(self, progress=None):
         # TODO: tests with uploading a file
         ''' Save a file to Google Drive
             ---------------------------
@@ -78,12 +313,20 @@ class GFileBase(IdMixin):
         optional:
             parents: A list of parents folder's ID.
             description: Description of the file to insert.
+            filename: local file to upload, sent by chunks of chunksize bytes.
+            An interrupted upload is resumed by the next save() call.
+
+        Arguments:
+            progress: callable, gets upload.UploadStats after every chunk.
+
+        Returns:
+            G<FileType> object, or GResult inside of GDrive.batch().
         '''
 
         if self._id is None:
-            return self._insert()
+            return self._insert(progress)
         else:
-            return self._update()
+            return self._update(progress)
 
     def delete(self):
         ''' Delete a file from Google Drive
@@ -92,10 +335,95 @@ class GFileBase(IdMixin):
         Reade more:
             https://developers.google.com/drive/v2/reference/files/delete
         '''
-        try:
-            return self.gdrive.service.files().delete(fileId=self._id).execute()
-        except errors.HttpError, error:
-            raise GError(error)
+        metadata_cache.delete(self._id)
+        request = self.gdrive.service.files().delete(fileId=self._id)
+        return self.gdrive.execute(request)
+
+    def iter_content(self, mime_type=None, chunk_size=DOWNLOAD_CHUNKSIZE, start=0):
+        ''' Download or export content chunk by chunk
+            -----------------------------------------
+
+        Arguments:
+            mime_type: export format of GDoc/GSheet, e.g. 'application/pdf',
+                None to download content of GFile.
+            chunk_size: bytes read at once, memory use is bounded by it.
+            start: offset to continue from, requested by the Range header.
+
+        Read more:
+            https://developers.google.com/drive/v2/web/manage-downloads
+        '''
+
+        url = self._content_url(mime_type)
+        headers = start and {'Range': 'bytes=%d-' % start} or None
+
+        with closing(self.gdrive.open(url, headers=headers)) as response:
+            skip = response.status != 206 and start or 0
+
+            while skip > 0:
+                # the server ignored Range, e.g. for export links
+                data = response.read(min(skip, chunk_size))
+
+                if not data:
+                    break
+
+                skip -= len(data)
+
+            while True:
+                chunk = response.read(chunk_size)
+
+                if not chunk:
+                    break
+
+                yield chunk
+
+    def download(self, f, mime_type=None, chunk_size=DOWNLOAD_CHUNKSIZE, resume=False):
+        ''' Download or export content to a file
+            ------------------------------------
+
+        Arguments:
+            f: path or file-like object.
+            resume: continue the partially downloaded file at the path. The
+                version of the content (md5Checksum of a file, etag of an
+                export) is kept next to it in <path>.version, a file of
+                another version is downloaded again from the start.
+        '''
+
+        if hasattr(f, 'write'):
+            for chunk in self.iter_content(mime_type, chunk_size):
+                f.write(chunk)
+
+            return f
+
+        start = 0
+
+        if resume:
+            version, size = self._version(mime_type)
+            version_path = f + '.version'
+
+            if os.path.exists(f) and self._read_version(version_path) == version:
+                start = os.path.getsize(f)
+
+            with open(version_path, 'w') as fp:
+                fp.write(version)
+
+        if not resume or size is None or start < size:
+            with open(f, start and 'ab' or 'wb') as fp:
+                for chunk in self.iter_content(mime_type, chunk_size, start):
+                    fp.write(chunk)
+
+        if resume:
+            os.remove(version_path)
+
+        return f
+
+    def streaming_response(self, mime_type=None, chunk_size=DOWNLOAD_CHUNKSIZE):
+        ''' Django StreamingHttpResponse of the content as an attachment '''
+
+        response = StreamingHttpResponse(self.iter_content(mime_type, chunk_size),
+                                         content_type=mime_type or self.mime_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % (
+            force_str(self.title or self._id).replace('"', ''))
+        return response
 
     ###################
     # Private methods #
@@ -106,7 +434,64 @@ class GFileBase(IdMixin):
         assert self.mime_type,\
             GError('Required mime_type: mime type of the file to insert')
 
-    def _insert(self):
+    def _content_url(self, mime_type=None):
+        item = self._raw
+
+        if 'downloadUrl' not in item and 'exportLinks' not in item:
+            # the object was listed with a fields projection
+            item = self.gdrive.send(self.gdrive.service.files().get(
+                fileId=self._id, fields='downloadUrl,exportLinks'))
+
+        if mime_type is None:
+            url = item.get('downloadUrl')
+        else:
+            url = (item.get('exportLinks') or {}).get(mime_type)
+
+        if url is None:
+            raise GError('The file can not be downloaded as %s' % (mime_type or 'is'))
+
+        return url
+
+    def _version(self, mime_type=None):
+        ''' Current version and size (None for an export) of the content '''
+
+        item = self.gdrive.send(self.gdrive.service.files().get(
+            fileId=self._id, fields='etag,md5Checksum,fileSize'))
+
+        if mime_type is None and 'md5Checksum' in item:
+            return force_str(item['md5Checksum']), int(item.get('fileSize', 0))
+
+        return force_str(item['etag']), None
+
+    @staticmethod
+    def _read_version(path):
+
+        try:
+            with open(path) as fp:
+                return fp.read()
+        except IOError:
+            return None
+
+    def _media_body(self):
+        return MediaFileUpload(self.filename, mimetype=self.file_mime_type,
+                               chunksize=self.chunksize, resumable=True)
+
+    def _execute(self, request, progress=None):
+
+        def wrap(item):
+            metadata_cache.set(item)
+            return GFactory(self.gdrive, item)
+
+        if self._id is not None:
+            metadata_cache.delete(self._id)
+
+        if self.filename is None:
+            return self.gdrive.execute(request, wrap)
+
+        key = session_key(self.filename, self._id, self.title, self.parents)
+        return self.gdrive.upload(request, key, progress, wrap)
+
+    def _insert(self, progress=None):
         ''' Insert new file.
             ----------------
 
@@ -116,8 +501,7 @@ class GFileBase(IdMixin):
         self._validate()
 
         if self.filename is not None:
-            media_body = MediaFileUpload(
-                self.filename, mimetype=self.file_mime_type, resumable=True)
+            media_body = self._media_body()
 
         body = {
             'convert': self.convert,
@@ -127,18 +511,15 @@ class GFileBase(IdMixin):
             'title': self.title,
         }
 
-        try:
-            params = {'body': body}
+        params = {'body': body}
 
-            if self.filename is not None:
-                params['media_body'] = media_body
+        if self.filename is not None:
+            params['media_body'] = media_body
 
-            insert_file = self.gdrive.service.files().insert(**params).execute()
-            return GFactory(self.gdrive, insert_file)
-        except errors.HttpError, error:
-            raise GError(error)
+        request = self.gdrive.service.files().insert(**params)
+        return self._execute(request, progress)
 
-    def _update(self):
+    def _update(self, progress=None):
         ''' Update an existing file's metadata and content.
             -----------------------------------------------
 
@@ -148,8 +529,7 @@ class GFileBase(IdMixin):
         self._validate()
 
         if self.filename is not None:
-            media_body = MediaFileUpload(
-                self.filename, mimetype=self.file_mime_type, resumable=True)
+            media_body = self._media_body()
 
         body = {
             'convert': self.convert,
@@ -159,20 +539,21 @@ class GFileBase(IdMixin):
             'title': self.title,
         }
 
-        try:
-            params = {'body': body, 'fileId': self._id, 'newRevision': True}
+        params = {'body': body, 'fileId': self._id, 'newRevision': True}
 
-            if self.filename is not None:
-                params['media_body'] = media_body
+        if self.filename is not None:
+            params['media_body'] = media_body
 
-            updated_file = self.gdrive.service.files().update(**params).execute()
-            return GFactory(self.gdrive, updated_file)
-        except errors.HttpError, error:
-            raise GError(error)
+        request = self.gdrive.service.files().update(**params)
+        return self._execute(request, progress)
 
 
 class GDoc(GFileBase):
-    mime_type = u'application/vnd.google-apps.document'
+    __slots__ = ()
+    mime_type = Field('mimeType', u'application/vnd.google-apps.document')
+
+
+BATCH_SIZE = getattr(settings, 'GDRIVE_CELLS_BATCH_SIZE', 1000)
 
 
 class GWorkSheet(IdMixin):
@@ -188,9 +569,14 @@ class GWorkSheet(IdMixin):
         self.col_count = item['col_count']
         self.row_count = item['row_count']
         self._id = item.get('id', None)
+        self.cells = CellCache()
+        self.last_results = []
 
     def __eq__(self, other):
-        return self._id == other.id
+        return self._id == other.get_id()
+
+    def __ne__(self, other):
+        return not self == other
 
     def save(self):
         ''' Attach to a file and upload to a Google Drive this worksheet
@@ -205,50 +591,102 @@ class GWorkSheet(IdMixin):
             Update does not works
         '''
 
-        for w in self._file.get_worksheets():
+        worksheets = self._file.get_worksheets()
+        same_title = worksheets.get_by_title(self.title)
 
-            if w != self and w.title == self.title:
-                raise GError('The worksheet with given title is already exists.')
+        if same_title is not None and same_title.get_id() != self._id:
+            raise GError('The worksheet with given title is already exists.')
 
         if self._id is None:
-            body = get_template('gdrive/insert_worksheet.xml').render(Context({'obj': self}))
-            url = 'https://spreadsheets.google.com/feeds/worksheets/%s/private/full'
+            body = worksheet_entry(self)
+            url = self.get_feeds_url() + '/worksheets/%s/private/full'
 
-            (resp, content) = self._file.gdrive.http.request(
-                url % self._file._id, 'POST', body=body,
-                headers={'content-type': 'application/atom+xml'})
+            try:
+                (resp, content) = self._file.gdrive.request(
+                    url % self._file._id, 'POST', body=body,
+                    headers={'content-type': 'application/atom+xml'})
+            except GError:
+                # e.g. another process has added the title, the index is stale
+                self._file.refresh_worksheets()
+                raise
 
-            root = ET.fromstring(content)
-            mutches = re.findall(r'xmlns\:?([^=]*?)=("(.+?)"|\'(.+?)\')', content, re.MULTILINE)
-            ns = {i[0]: i[2] or i[3] for i in mutches}
-            ns['default'] = ns['']
-            self._id = root.find('default:id', ns).text.split('/')[-1]
+            self._id = ET.fromstring(content).findtext(ATOM_ID).split('/')[-1]
 
             if self._id:
-                w_list = self._file.get_worksheets()
-                w_list += [self]
+                worksheets.add(self)
             else:
                 raise GError('Worksheet attaching error.')
 
         else:
-            body = get_template('gdrive/update_worksheet.xml').render(Context({'obj': self}))
-            url = 'https://spreadsheets.google.com/feeds/worksheets/%s/private/full/%s/version'
+            body = worksheet_entry(self)
+            url = self.get_feeds_url() + '/worksheets/%s/private/full/%s/version'
 
-            (resp, content) = self._file.gdrive.http.request(
+            (resp, content) = self._file.gdrive.request(
                 url % (self._file._id, self._id), 'PUT', body=body,
                 headers={'content-type': 'application/atom+xml'})
 
+            worksheets.reindex(self)
             return content
 
-    def retrieve_cells(self):
-        # TODO: make good
+    def retrieve_cells(self, *args, **kwargs):
+        ''' Retrieve cells feed as a string, see open_cells() for arguments '''
+
+        with closing(self.open_cells(*args, **kwargs)) as response:
+            return response.read()
+
+    def open_cells(self, min_row=None, max_row=None, min_col=None, max_col=None,
+                   return_empty=False, updated_min=None):
+        ''' Open cells feed stream, whole or limited by the range
+            -----------------------------------------------------
 
-        url = 'https://spreadsheets.google.com/feeds/cells/%s/%s/private/full'
+        Arguments:
+            min_row, max_row, min_col, max_col: range of cells, 1-based.
+            return_empty: include empty cells of the range, which is
+                required to get edit links of cells never written before.
+            updated_min: only cells updated since the timestamp.
 
-        (resp, content) = self._file.gdrive.http.request(
-            url % (self._file._id, self._id), 'GET')
+        Read more:
+            https://developers.google.com/google-apps/spreadsheets/data#fetch_specific_rows_or_columns
+        '''
+
+        url = self.get_feeds_url() + '/cells/%s/%s/private/full' % (
+            self._file._id, self._id)
+        params = [
+            ('min-row', min_row),
+            ('max-row', max_row),
+            ('min-col', min_col),
+            ('max-col', max_col),
+            ('return-empty', return_empty and 'true' or None),
+            ('updated-min', updated_min),
+        ]
+        query = urllib.urlencode([(k, v) for k, v in params if v is not None])
+
+        if query:
+            url += '?' + query
+
+        return self._file.gdrive.open(url)
+
+    def refresh_cells(self, keys=()):
+        ''' Bring the cell cache up to date for the keys
+            --------------------------------------------
+
+        Cells changed since the last fetch are retrieved by updated-min,
+        unknown cells are retrieved by a single request limited to their
+        range.
+        '''
+
+        if self.cells.updated is not None:
+            with closing(self.open_cells(updated_min=self.cells.updated)) as response:
+                self.cells.update(response)
 
-        return content
+        missing = self.cells.missing(keys)
+
+        if missing:
+            min_row, max_row, min_col, max_col = bounds(missing)
+
+            with closing(self.open_cells(min_row, max_row, min_col, max_col,
+                                         return_empty=True)) as response:
+                self.cells.update(response, stamp=self.cells.updated is None)
 
     def update_multiple_cells(self, cells):
         ''' Update batch of rows using R1C1 notation
@@ -256,41 +694,51 @@ class GWorkSheet(IdMixin):
         Cells is a dicts, for example:
             {'R1C1': 'title', 'R1C2': 'count', 'R2C1': 'apples', 'R2C2': 10}
 
+        Returns:
+            content of the batch response, results of every cell are in
+            the last_results attribute as CellResult list.
+
         TODO: tests
         '''
 
         if self._id is not None:
-            content = self.retrieve_cells()
-            ns = get_xml_ns(content)
-            ET.register_namespace('', ns['default'])
-            root = ET.fromstring(content)
-            edit_links = {}
-
-            for entry in root.findall('default:entry', ns):
-                cell_id = entry.find('default:id', ns).text.split('/')[-1]
-                edit_links[cell_id] = ET.tostring(entry.find('default:link[@rel=\'edit\']', ns))
-
-            body = get_template('gdrive/update_multiple_cells.xml').render(
-                Context({'obj': self, 'cells': cells, 'links': edit_links}))
-            url = 'https://spreadsheets.google.com/feeds/cells/%s/%s/private/full/batch'
-
-            (resp, content) = self._file.gdrive.http.request(
-                url % (self._file._id, self._id), 'POST', body=body,
-                headers={'content-type': 'application/atom+xml'})
+            self.refresh_cells(cells.keys())
+            content, self.last_results = self._write_batch(cells.items(), self.cells)
+            return content
 
-            # checking for errors
-            # ns = get_xml_ns(content)
-            # root = ET.fromstring(content)
+    def bulk_update(self, rows, start_row=1, start_col=1, batch_size=BATCH_SIZE, workers=4):
+        ''' Write rows by batches with bounded concurrency
+            ----------------------------------------------
 
-            # for entry in root.findall('atom:entry', ns):
-            #     title = entry.find('atom:title', ns).text
+        Arguments:
+            rows: iterable of rows, a row is a sequence of values, None
+                values are skipped. Rows are consumed lazily.
+            start_row, start_col: R1C1 position of the first value.
+            batch_size: cells per batch request.
+            workers: batches being sent at the same time.
 
-            #     if title == 'Error':
-            #         cell_id = entry.find('atom:id', ns).text.split('/')[-1]
-            #         c = entry.find('atom:title', ns).text
-            #         raise GError()
+        Yields:
+            CellResult of every written cell in the order of rows.
+        '''
 
-            return content
+        pool = ThreadPool(workers)
+        pending = deque()
+
+        try:
+            for items in self._cell_batches(rows, start_row, start_col, batch_size):
+                pending.append(pool.apply_async(self._write_range, (items,)))
+
+                while len(pending) >= workers:
+                    for result in pending.popleft().get():
+                        yield result
+
+            while pending:
+                for result in pending.popleft().get():
+                    yield result
+
+        finally:
+            pool.close()
+            pool.join()
 
     def get_id(self):
         return self._id
@@ -298,64 +746,120 @@ class GWorkSheet(IdMixin):
     def get_file_id(self):
         return self._file._id
 
+    def get_feeds_url(self):
+        return self._file.gdrive.feeds_url
+
+    ###################
+    # Private methods #
+    ###################
+    def _cell_batches(self, rows, start_row, start_col, batch_size):
+        items = []
+
+        for r, row in enumerate(rows, start_row):
+            for c, value in enumerate(row, start_col):
+
+                if value is None:
+                    continue
+
+                items += [('R%dC%d' % (r, c), value)]
+
+                if len(items) >= batch_size:
+                    yield items
+                    items = []
+
+        if items:
+            yield items
+
+    def _write_range(self, items):
+        # bulk writes do not keep edit links, only the batch range is fetched
+        cache = CellCache()
+        min_row, max_row, min_col, max_col = bounds([key for key, value in items])
+
+        with closing(self.open_cells(min_row, max_row, min_col, max_col,
+                                     return_empty=True)) as response:
+            cache.update(response)
+
+        return self._write_batch(items, cache)[1]
+
+    def _write_batch(self, items, cache):
+        links = dict((key, cache.edit_link(key)) for key, value in items)
+        body = cells_feed(self, items, links)
+        url = self.get_feeds_url() + '/cells/%s/%s/private/full/batch'
+
+        (resp, content) = self._file.gdrive.request(
+            url % (self._file._id, self._id), 'POST', body=body,
+            headers={'content-type': 'application/atom+xml'}, raise_for_status=False)
+
+        if resp.status >= 400:
+            return content, [CellResult(key, value, False, resp.status, resp.reason)
+                             for key, value in items]
+
+        # written cells have got new versions
+        cache.update(content, stamp=False)
+        return content, parse_batch_response(content, items)
+
 
 class GSheet(GFileBase):
-    mime_type = u'application/vnd.google-apps.spreadsheet'
-    _worksheets = None
+    __slots__ = ('_worksheets',)
+    mime_type = Field('mimeType', u'application/vnd.google-apps.spreadsheet')
 
     def __init__(self, gdrive, item):
         super(GSheet, self).__init__(gdrive, item)
+        self._worksheets = None
 
     def get_worksheets(self):
         ''' Lazy retrieving all worksheets for file with id
             -----------------------------------------------
 
         Returns:
-            None or list of GWorkSheet objects
+            None or WorksheetIndex of GWorkSheet objects, which works as a
+            list and looks worksheets up by title and by id.
 
         Wotch more:
             https://developers.google.com/google-apps/spreadsheets/
         '''
 
         if self._id and self._worksheets is None:
-            url = 'https://spreadsheets.google.com/feeds/worksheets/%s/private/full'
-            (resp, content) = self.gdrive.http.request(url % self._id, 'GET')
-            root = ET.fromstring(content)
-            ns = get_xml_ns(content)
-            self._worksheets = []
-
-            for entry in root.findall('default:entry', ns):
-                id = entry.find('default:id', ns).text.split('/')[-1]
-                updated = entry.find('default:updated', ns).text
-                title = entry.find('default:title', ns).text
-                col_count = entry.find('gs:colCount', ns).text
-                row_count = entry.find('gs:rowCount', ns).text
-                item = {
-                    'updated': updated,
-                    'title': title,
-                    'col_count': int(col_count),
-                    'row_count': int(row_count),
-                    'id': id,
-                }
-                w = GWorkSheet(self, item)
-                self._worksheets += [w]
+            self.refresh_worksheets()
 
         return self._worksheets
 
+    def refresh_worksheets(self):
+        ''' Refresh worksheets changed by another writer
+            --------------------------------------------
 
-class GFolder(GFileBase):
-    mime_type = u'application/vnd.google-apps.folder'
+        The request is conditional on the feed ETag, so an unchanged
+        spreadsheet costs a 304 response without a body.
 
+        Returns:
+            True if the worksheets have been changed.
+        '''
 
-class GFile(GFileBase):
+        url = self.gdrive.feeds_url + '/worksheets/%s/private/full'
+        headers = {'GData-Version': '3.0'}
 
-    def __init__(self, gdrive, item):
-        super(GFile, self).__init__(gdrive, item)
+        if self._worksheets is not None and self._worksheets.version:
+            headers['If-None-Match'] = self._worksheets.version
 
-        try:
-            self.mime_type = item['mimeType']
-        except KeyError:
-            pass
+        with closing(self.gdrive.open(url % self._id, headers=headers)) as response:
+
+            if response.status == 304:
+                return False
+
+            self._worksheets = WorksheetIndex(
+                [GWorkSheet(self, item) for item in iter_worksheets(response)],
+                response.getheader('etag'))
+
+        return True
+
+
+class GFolder(GFileBase):
+    __slots__ = ()
+    mime_type = Field('mimeType', u'application/vnd.google-apps.folder')
+
+
+class GFile(GFileBase):
+    __slots__ = ()
 
 
 class GFactory(object):
@@ -372,40 +876,85 @@ class GFactory(object):
         except KeyError:
             return GFile(gdrive, item)
 
-    def filter(self, gdrive, **kwargs):
+    @classmethod
+    def filter(cls, gdrive, page_size=100, fields=FILE_FIELDS, prefetch=True, **kwargs):
         ''' Get list of files (and folders which are files too)
             ---------------------------------------------------
 
         Works like a Django model .objects.filter(). For more information use:
             https://developers.google.com/drive/v2/reference/files/list
+
+        Lazy generator over the whole listing: follows nextPageToken until
+        the last page.
+
+        Arguments:
+            page_size: maxResults of a single files().list call (up to 1000).
+            fields: projection of a file resource, e.g. 'id,title,mimeType',
+                nextPageToken is added automatically. FILE_FIELDS by default,
+                None for full resources.
+            prefetch: fetch the next page in background, while the caller
+                works with the current one.
         '''
 
-        if not kwargs:
-            kwargs['maxResults'] = 10
+        kwargs.setdefault('maxResults', page_size)
 
-        try:
-            results = gdrive.service.files().list(**kwargs).execute()
+        if fields is not None:
+            kwargs['fields'] = 'nextPageToken,items(%s)' % fields
 
-            for item in results.get('items', []):
+        pages = cls._pages(gdrive, **kwargs)
+
+        if prefetch:
+            pages = prefetch_iter(pages)
+
+        for items in pages:
+            for item in items:
                 yield GFactory(gdrive, item)
 
-        except errors.HttpError, error:
-            raise GError(error)
+    @staticmethod
+    def _pages(gdrive, **kwargs):
+
+        while True:
+            results = gdrive.send(gdrive.service.files().list(**kwargs))
+            yield results.get('items', [])
+            page_token = results.get('nextPageToken')
+
+            if not page_token:
+                break
+
+            kwargs['pageToken'] = page_token
 
     @classmethod
-    def get(cls, gdrive, id):
+    def get(cls, gdrive, id, cached=True, fields=None):
         ''' Get a file from Google Drive
             ----------------------------
 
         Read more:
             https://developers.google.com/drive/v2/reference/files/get
+
+        Metadata is kept in the Django cache (GDRIVE_METADATA_CACHE alias)
+        and revalidated by ETag, so an unchanged file comes back as
+        304 Not Modified without a body. A partial resource requested by
+        fields projection, e.g. 'id,title,mimeType', is not cached.
+
+        Returns:
+            G<FileType> object, or GResult inside of GDrive.batch().
         '''
 
-        try:
-            result = gdrive.service.files().get(fileId=id).execute()
+        if fields is not None:
+            request = gdrive.service.files().get(fileId=id, fields=fields)
+            return gdrive.execute(request, lambda result: GFactory(gdrive, result))
+
+        request = gdrive.service.files().get(fileId=id)
+        item = cached and metadata_cache.get(id) or None
+
+        if item is not None:
+            request.headers['If-None-Match'] = item['etag']
+
+        def wrap(result):
+            metadata_cache.set(result)
             return GFactory(gdrive, result)
-        except errors.HttpError, error:
-            raise GError(error)
+
+        return gdrive.execute(request, wrap, item)
 
 
 class GDrive(object):
@@ -416,7 +965,294 @@ class GDrive(object):
     Use in subclass of generic view, wich is also subclass of OAuthMixin.
     '''
 
-    def __init__(self, request):
-        credentials = OAuth2Credentials.from_json(request.session['gdrive_oauth_credentials'])
-        self.http = credentials.authorize(httplib2.Http())
-        self.service = discovery.build('drive', 'v2', http=self.http)
+    batch_uri = getattr(settings, 'GDRIVE_BATCH_URI',
+                        'https://www.googleapis.com/batch/drive/v2')
+    feeds_url = FEEDS_URL
+    _cache = LRUCache(getattr(settings, 'GDRIVE_CACHE_SIZE', 1000))
+    refresh_margin = datetime.timedelta(
+        seconds=getattr(settings, 'GDRIVE_REFRESH_MARGIN', 300))
+
+    def __init__(self, request=None, credentials=None, user_key=None):
+
+        if credentials is None:
+            credentials = OAuth2Credentials.from_json(request.session[SESSION_KEY])
+
+        self.credentials = credentials
+        self.user_key = user_key
+        self.scheduler = get_scheduler()
+        self._lock = threading.Lock()
+        # the object is shared by requests of the user, batches are not
+        self._local = threading.local()
+        self.http = self.credentials.authorize(PooledHttp())
+        self.service = build_service('drive', 'v2', self.http)
+
+    @property
+    def _batch(self):
+        ''' GBatch opened by batch() in the current thread or None '''
+
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, batch):
+        self._local.batch = batch
+
+    @classmethod
+    def for_request(cls, request):
+        ''' Cached GDrive of the user (or the session, for anonymous)
+            --------------------------------------------------------
+
+        The service lives in a process-wide LRU cache until the token
+        expiry. The token is refreshed ahead of time and written back to
+        the session.
+
+        Returns:
+            GDrive object or None, if there are no valid credentials.
+        '''
+
+        credentials_json = request.session.get(SESSION_KEY)
+
+        if credentials_json is None:
+            return None
+
+        if getattr(request, 'user', None) is not None and request.user.is_authenticated():
+            key = 'user:%s' % request.user.pk
+        else:
+            key = 'session:%s' % request.session.session_key
+
+        cached = cls._cache.get(key)
+
+        if cached is not None and cached[0] == credentials_json:
+            gdrive = cached[1]
+        else:
+            gdrive = cls(credentials=OAuth2Credentials.from_json(credentials_json), user_key=key)
+
+        try:
+            gdrive.refresh_ahead()
+        except GError:
+            cls._cache.delete(key)
+            return None
+
+        if gdrive.credentials.to_json() != credentials_json:
+            credentials_json = gdrive.credentials.to_json()
+            request.session[SESSION_KEY] = credentials_json
+            request.session.modified = True
+
+        cls._cache.set(key, (credentials_json, gdrive), gdrive.expires())
+        return gdrive
+
+    def expires(self):
+        ''' Unix timestamp of the token expiry or None '''
+
+        if self.credentials.token_expiry is None:
+            return None
+
+        return calendar.timegm(self.credentials.token_expiry.utctimetuple())
+
+    def refresh_ahead(self):
+        ''' Refresh the access token, if it expires within refresh_margin
+
+        Returns:
+            True if the token was refreshed.
+        '''
+
+        if self.credentials.token_expiry is None or self.credentials.refresh_token is None:
+            return False
+
+        with self._lock:
+            expiry = self.credentials.token_expiry
+
+            if expiry - self.refresh_margin > datetime.datetime.utcnow():
+                return False
+
+            try:
+                self.credentials.refresh(PooledHttp())
+            except AccessTokenRefreshError, error:
+                raise GError(error)
+
+        return True
+
+    def open(self, url, method='GET', body=None, headers=None, retry=None):
+        ''' Streamed request, e.g. to a spreadsheets feed
+            --------------------------------------------
+
+        Arguments:
+            retry: retry 5xx errors, by default only of idempotent methods.
+
+        Returns:
+            httplib.HTTPResponse, read and close it. Redirects are followed,
+            any other status but 2xx and 304 Not Modified raises GError.
+        '''
+
+        def call():
+            response = open_stream(self.credentials, url, method, body, headers, self._lock)
+
+            if not 200 <= response.status < 300 and response.status != 304:
+                content = response.read()
+                response.close()
+                raise errors.HttpError(response, content, uri=url)
+
+            return response
+
+        try:
+            return self.scheduler.call(call, self.user_key, self._idempotent(method, retry))
+        except errors.HttpError, error:
+            raise GError(error)
+
+    def request(self, url, method='GET', body=None, headers=None, raise_for_status=True,
+                retry=None):
+        ''' Raw request, e.g. to a spreadsheets feed
+            ---------------------------------------
+
+        Arguments:
+            retry: retry 5xx errors, by default only of idempotent methods,
+                e.g. a worksheet inserted by a failed POST would be doubled.
+
+        Returns:
+            (response, content) tuple like httplib2.Http.request().
+        '''
+
+        def call():
+            (resp, content) = self.http.request(url, method, body=body, headers=headers)
+
+            if resp.status >= 400:
+                raise errors.HttpError(resp, content, uri=url)
+
+            return resp, content
+
+        try:
+            return self.scheduler.call(call, self.user_key, self._idempotent(method, retry))
+        except errors.HttpError, error:
+
+            if raise_for_status:
+                raise GError(error)
+
+            return error.resp, error.content
+
+    def send(self, request, wrap=None, cached=None):
+        ''' Execute Drive API request right away, even inside of batch() '''
+
+        try:
+            response = self.scheduler.call(
+                lambda: request.execute(http=self.http), self.user_key)
+        except errors.HttpError, error:
+
+            if not is_not_modified(error, cached):
+                raise GError(error)
+
+            response = cached
+
+        return self._wrap(response, wrap)
+
+    def execute(self, request, wrap=None, cached=None):
+        ''' Execute Drive API request or queue it, if batch is active
+            --------------------------------------------------------
+
+        Arguments:
+            request: apiclient HttpRequest.
+            wrap: callable, which converts the response, e.g. to GFactory.
+            cached: response to use on 304 Not Modified, when the request
+                is conditional (If-None-Match).
+        '''
+
+        if self._batch is not None:
+            return self._batch.add(request, wrap, cached)
+
+        return self.send(request, wrap, cached)
+
+    def upload(self, request, key=None, progress=None, wrap=None):
+        ''' Execute resumable media request chunk by chunk
+
+        Media uploads can not be batched, so inside of the batch() block
+        it is sent right away and returned as resolved GResult.
+        '''
+
+        result = GResult()
+
+        try:
+            result.set_result(self._wrap(
+                resumable_execute(self.http, request, key, progress,
+                                  call=lambda f: self.scheduler.call(f, self.user_key)), wrap))
+        except errors.HttpError, error:
+            result.set_exception(GError(error))
+
+        if self._batch is not None:
+            return result
+
+        return result.result()
+
+    @contextmanager
+    def batch(self, size=GBatch.max_size):
+        ''' Send save(), delete() and GFactory.get() calls in batches
+            --------------------------------------------------------
+
+        Usage:
+        ::
+            with gdrive.batch():
+                results = [GFactory.get(gdrive, id) for id in ids]
+
+            files = [r.result() for r in results]
+
+        Each call returns GResult, resolved on exit from the block or
+        every time the queue reaches size (up to 100) calls. The batch
+        belongs to the thread, calls of other threads are sent as usual.
+        '''
+
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        self._batch = GBatch(self, size)
+
+        try:
+            yield self._batch
+            self._batch.flush()
+        finally:
+            self._batch.abort()
+            self._batch = None
+
+    def _idempotent(self, method, retry=None):
+
+        if retry is not None:
+            return retry
+
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def _wrap(self, response, wrap):
+
+        if wrap is None:
+            return response
+
+        return wrap(response)
+
+
+def upload_files(files, workers=4, progress=None):
+    ''' Save several G<FileType> objects concurrently
+        ---------------------------------------------
+
+    Arguments:
+        files: G<FileType> objects with filename to upload.
+        workers: size of the thread pool.
+        progress: callable, gets upload.UploadStats of every file from the
+            worker threads.
+
+    Returns:
+        List of resolved GResult in the order of files.
+    '''
+
+    def save(f):
+        result = GResult()
+
+        try:
+            result.set_result(f.save(progress=progress))
+        except GError, error:
+            result.set_exception(error)
+
+        return result
+
+    pool = ThreadPool(workers)
+
+    try:
+        return pool.map(save, files)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import re
+import xml.etree.ElementTree as ET
+from cStringIO import StringIO
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+from django.conf import settings
+from django.utils.encoding import force_unicode
+
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+BATCH_NS = 'http://schemas.google.com/gdata/batch'
+GS_NS = 'http://schemas.google.com/spreadsheets/2006'
+FEEDS_URL = getattr(settings, 'GDRIVE_FEEDS_URL', 'https://spreadsheets.google.com/feeds')
+
+ATOM_ENTRY = '{%s}entry' % ATOM_NS
+ATOM_ID = '{%s}id' % ATOM_NS
+ATOM_LINK = '{%s}link' % ATOM_NS
+ATOM_TITLE = '{%s}title' % ATOM_NS
+ATOM_UPDATED = '{%s}updated' % ATOM_NS
+BATCH_ID = '{%s}id' % BATCH_NS
+BATCH_STATUS = '{%s}status' % BATCH_NS
+GS_CELL = '{%s}cell' % GS_NS
+GS_COL_COUNT = '{%s}colCount' % GS_NS
+GS_ROW_COUNT = '{%s}rowCount' % GS_NS
+
+r1c1_re = re.compile(r'^R(\d+)C(\d+)$')
+
+
+def parse_key(key):
+    ''' R1C1 key to (row, col) tuple '''
+
+    match = r1c1_re.match(key)
+
+    if match is None:
+        raise ValueError('Wrong R1C1 cell key: %s' % key)
+
+    return int(match.group(1)), int(match.group(2))
+
+
+def iter_feed(source):
+    ''' Read Atom feed incrementally
+        ----------------------------
+
+    Arguments:
+        source: XML string or file-like object, e.g. a response stream.
+
+    Yields:
+        ('updated', text) for the feed timestamp and ('entry', element)
+        for every entry. An entry is cleared, when the consumer takes the
+        next one, so only one entry is kept in memory.
+    '''
+
+    if isinstance(source, basestring):
+        source = StringIO(source)
+
+    root = None
+    depth = 0
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+
+        if event == 'start':
+
+            if root is None:
+                root = elem
+
+            depth += 1
+            continue
+
+        depth -= 1
+
+        if depth == 1 and elem.tag == ATOM_UPDATED:
+            yield 'updated', elem.text
+        elif depth == 1 and elem.tag == ATOM_ENTRY:
+            yield 'entry', elem
+            root.clear()
+
+
+def entry_id(entry):
+    return entry.findtext(ATOM_ID).split('/')[-1]
+
+
+def edit_link(entry):
+
+    for link in entry.findall(ATOM_LINK):
+
+        if link.get('rel') == 'edit':
+            return link.get('href')
+
+    return None
+
+
+def iter_worksheets(source):
+    ''' Items of GWorkSheet from the worksheets feed '''
+
+    for kind, entry in iter_feed(source):
+
+        if kind == 'entry':
+            yield {
+                'id': entry_id(entry),
+                'updated': entry.findtext(ATOM_UPDATED),
+                'title': entry.findtext(ATOM_TITLE),
+                'col_count': int(entry.findtext(GS_COL_COUNT)),
+                'row_count': int(entry.findtext(GS_ROW_COUNT)),
+            }
+
+
+def worksheet_entry(obj):
+    ''' Atom entry of GWorkSheet, with id if it is already attached '''
+
+    chunks = [u'<entry xmlns="%s" xmlns:gs="%s">' % (ATOM_NS, GS_NS)]
+
+    if obj.get_id() is not None:
+        chunks += [u'<id>%s/worksheets/%s/private/full/%s</id>' % (
+            obj.get_feeds_url(), obj.get_file_id(), obj.get_id())]
+
+    chunks += [
+        u'<title>%s</title>' % escape(force_unicode(obj.title)),
+        u'<gs:rowCount>%d</gs:rowCount>' % obj.row_count,
+        u'<gs:colCount>%d</gs:colCount>' % obj.col_count,
+        u'</entry>',
+    ]
+    return u''.join(chunks).encode('utf-8')
+
+
+def iter_cells_feed(obj, items, links):
+    ''' Atom batch feed of cell updates, chunk by chunk
+
+    Arguments:
+        obj: GWorkSheet.
+        items: iterable of (R1C1 key, value).
+        links: dict of edit links by key.
+
+    Batch ids are A<n> for the n-th item.
+    '''
+
+    cells_url = u'%s/cells/%s/%s/private/full' % (
+        obj.get_feeds_url(), obj.get_file_id(), obj.get_id())
+    yield u'<feed xmlns="%s" xmlns:batch="%s" xmlns:gs="%s"><id>%s</id>' % (
+        ATOM_NS, BATCH_NS, GS_NS, cells_url)
+
+    for i, (key, value) in enumerate(items, 1):
+        row, col = parse_key(key)
+        yield (u'<entry><batch:id>A%d</batch:id><batch:operation type="update"/>'
+               u'<id>%s/%s</id>'
+               u'<link rel="edit" type="application/atom+xml" href=%s/>'
+               u'<gs:cell row="%d" col="%d" inputValue=%s/></entry>') % (
+            i, cells_url, key, quoteattr(links.get(key, u'')),
+            row, col, quoteattr(force_unicode(value)))
+
+    yield u'</feed>'
+
+
+def cells_feed(obj, items, links):
+    ''' Request body of iter_cells_feed() '''
+
+    return u''.join(iter_cells_feed(obj, items, links)).encode('utf-8')
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+
+class LRUCache(object):
+
+    ''' Thread-safe LRU cache with expiry time of each entry
+        ----------------------------------------------------
+
+    Arguments:
+        maxsize: the least recently used entries are dropped above it.
+    '''
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+
+        with self._lock:
+            try:
+                value, expires = self._data.pop(key)
+            except KeyError:
+                return default
+
+            if expires is not None and expires <= time.time():
+                return default
+
+            self._data[key] = (value, expires)
+            return value
+
+    def set(self, key, value, expires=None):
+        ''' expires: unix timestamp or None for no expiry '''
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+
+
+class MetadataCache(object):
+
+    ''' File metadata with ETag in the Django cache
+        -------------------------------------------
+
+    Shared by processes. Bound its size by MAX_ENTRIES of a dedicated
+    cache alias, items larger than max_item_size are not cached.
+    Entries are only used for If-None-Match revalidation, never served
+    without asking Google.
+    '''
+
+    prefix = 'gdrive:file:'
+
+    def __init__(self, alias='default', timeout=24 * 3600, max_item_size=64 * 1024):
+        self.alias = alias
+        self.timeout = timeout
+        self.max_item_size = max_item_size
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, file_id):
+        data = self.cache.get(self.prefix + file_id)
+        return data and json.loads(data) or None
+
+    def set(self, item):
+
+        if not isinstance(item, dict) or not item.get('id') or not item.get('etag'):
+            return
+
+        data = json.dumps(item)
+
+        if len(data) <= self.max_item_size:
+            self.cache.set(self.prefix + item['id'], data, self.timeout)
+
+    def delete(self, file_id):
+
+        if file_id:
+            self.cache.delete(self.prefix + file_id)
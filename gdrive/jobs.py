@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+
+from django.conf import settings
+from oauth2client.client import OAuth2Credentials
+import django_rq
+
+from bicycle.gdrive import GDrive
+from bicycle.gdrive import GError
+from bicycle.gdrive import GFactory
+from bicycle.gdrive import GWorkSheet
+
+
+QUEUE = getattr(settings, 'GDRIVE_RQ_QUEUE', 'default')
+RESULT_TTL = getattr(settings, 'GDRIVE_RQ_RESULT_TTL', 3600)
+PENDING = ('queued', 'started', 'deferred')
+
+
+def _gdrive(credentials_json, user_key):
+    return GDrive(credentials=OAuth2Credentials.from_json(credentials_json), user_key=user_key)
+
+
+def _worksheet(gdrive, file_id, worksheet_id):
+
+    w = GFactory.get(gdrive, file_id).get_worksheets().get_by_id(worksheet_id)
+
+    if w is None:
+        raise GError('Worksheet %s is not found' % worksheet_id)
+
+    return w
+
+
+# Jobs, run by rqworker
+
+def save_file(credentials_json, user_key, item):
+    obj = GFactory(_gdrive(credentials_json, user_key), item)
+    return obj.save().get_raw()
+
+
+def save_worksheet(credentials_json, user_key, file_id, item):
+    f = GFactory.get(_gdrive(credentials_json, user_key), file_id)
+    w = GWorkSheet(f, item)
+    w.save()
+    return w.get_id()
+
+
+def update_cells(credentials_json, user_key, file_id, worksheet_id, cells):
+    w = _worksheet(_gdrive(credentials_json, user_key), file_id, worksheet_id)
+    w.update_multiple_cells(cells)
+    return [r._asdict() for r in w.last_results]
+
+
+# Enqueue helpers, used in views
+
+def enqueue(gdrive, func, *args):
+    ''' Enqueue the job with credentials of gdrive
+        ------------------------------------------
+
+    The same call of the same user is not enqueued twice, while it is
+    queued or running: the pending job is returned instead.
+
+    Returns:
+        rq Job, poll it by JobStatusView with job.id.
+    '''
+
+    payload = json.dumps([func.__name__, gdrive.user_key, args], sort_keys=True, default=repr)
+    job_id = 'gdrive-%s' % hashlib.md5(payload).hexdigest()
+    queue = django_rq.get_queue(QUEUE)
+    job = queue.fetch_job(job_id)
+
+    if job is not None and job.get_status() in PENDING:
+        return job
+
+    return queue.enqueue_call(func, args=(gdrive.credentials.to_json(), gdrive.user_key) + args,
+                              job_id=job_id, result_ttl=RESULT_TTL)
+
+
+def enqueue_save(obj):
+    ''' G<FileType>.save() in background, without a file to upload '''
+
+    item = dict(obj.get_raw())
+    item.update({
+        'title': obj.title,
+        'description': obj.description,
+        'mimeType': obj.mime_type,
+        'parents': obj.parents,
+        'convert': obj.convert,
+    })
+    return enqueue(obj.gdrive, save_file, item)
+
+
+def enqueue_save_worksheet(w):
+    item = {'title': w.title, 'col_count': w.col_count, 'row_count': w.row_count}
+    return enqueue(w._file.gdrive, save_worksheet, w.get_file_id(), item)
+
+
+def enqueue_update_cells(w, cells):
+    return enqueue(w._file.gdrive, update_cells, w.get_file_id(), w.get_id(), cells)
+
+
+def job_status(job_id, user_key=None):
+    ''' Status dict of the job or None, if there is no such job of the user '''
+
+    if not job_id.startswith('gdrive-'):
+        # e.g. a search index job of the same queue
+        return None
+
+    job = django_rq.get_queue(QUEUE).fetch_job(job_id)
+
+    # the second argument of every job is the user key
+    if job is None or len(job.args) < 2 or job.args[1] != user_key:
+        return None
+
+    status = job.get_status()
+    data = {'id': job.id, 'status': status}
+
+    if status == 'finished':
+        data['result'] = job.result
+    elif status == 'failed':
+        data['error'] = (job.exc_info or '').strip().split('\n')[-1]
+
+    return data
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from django.db import models
+
+
+class GSyncStateModelBase(models.Model):
+    ''' State of gdrive.sync.GSync: start page token of the changes feed '''
+
+    root_id = models.CharField(max_length=128, unique=True)
+    page_token = models.CharField(max_length=128, blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+
+class GFileIndexModelBase(models.Model):
+    ''' Local index of a synced file: id, parents and modification time '''
+
+    file_id = models.CharField(max_length=128, unique=True)
+    parents = models.TextField(blank=True)
+    modified_date = models.CharField(max_length=32, blank=True)
+
+    def get_parents(self):
+        return filter(None, self.parents.split(','))
+
+    class Meta:
+        abstract = True
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from multiprocessing.pool import ThreadPool
+
+from bicycle.gdrive import GError
+from bicycle.gdrive import GFactory
+from bicycle.gdrive import GResult
+
+
+class GParallel(object):
+
+    ''' Concurrent GFactory, GSheet and GWorkSheet calls
+        ------------------------------------------------
+
+    Sends independent requests at the same time from a thread pool and
+    returns the same model objects as the sequential calls. Results are
+    lists of resolved GResult in the order of arguments.
+
+    Usage:
+    ::
+        with GParallel(gdrive) as p:
+            sheets = [r.result() for r in p.get(ids)]
+            worksheets = p.get_worksheets(sheets)
+    '''
+
+    def __init__(self, gdrive, workers=8):
+        self.gdrive = gdrive
+        self.pool = ThreadPool(workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def map(self, func, items):
+        ''' Call func for every item concurrently, returns list of GResult '''
+
+        def call(item):
+            result = GResult()
+
+            try:
+                result.set_result(func(item))
+            except GError, error:
+                result.set_exception(error)
+
+            return result
+
+        return self.pool.map(call, items)
+
+    def get(self, ids):
+        ''' GFactory.get() of every id '''
+
+        return self.map(lambda id: GFactory.get(self.gdrive, id), ids)
+
+    def filter(self, queries):
+        ''' List of files for every dict of GFactory.filter() kwargs '''
+
+        return self.map(lambda kwargs: list(GFactory.filter(self.gdrive, **kwargs)), queries)
+
+    def get_worksheets(self, sheets):
+        ''' GSheet.get_worksheets() of every sheet '''
+
+        return self.map(lambda sheet: sheet.get_worksheets(), sheets)
+
+    def update_multiple_cells(self, updates):
+        ''' GWorkSheet.update_multiple_cells() of every (worksheet, cells) pair '''
+
+        return self.map(lambda (worksheet, cells): worksheet.update_multiple_cells(cells),
+                        updates)
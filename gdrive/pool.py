@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import httplib
+import socket
+import threading
+import urlparse
+import Queue
+
+from apiclient import discovery
+from apiclient import errors
+import httplib2
+
+from django.conf import settings
+
+
+class HttpPool(object):
+
+    ''' Pool of keep-alive httplib2.Http objects
+        ----------------------------------------
+
+    httplib2.Http is not thread-safe, so every request takes its own object
+    from the pool and gives it back when the response is read. Open
+    connections are reused by the following requests.
+    '''
+
+    def __init__(self, size=10, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self._pool = Queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+
+        try:
+            return self._pool.get_nowait()
+        except Queue.Empty:
+            return httplib2.Http(timeout=self.timeout)
+
+    def release(self, http):
+
+        try:
+            self._pool.put_nowait(http)
+        except Queue.Full:
+            pass
+
+
+class PooledHttp(object):
+
+    ''' Thread-safe httplib2.Http compatible object
+        -------------------------------------------
+
+    Authorize it like a regular httplib2.Http:
+    ::
+        http = credentials.authorize(PooledHttp())
+    '''
+
+    def __init__(self, pool=None):
+        self.pool = pool or get_pool()
+        self.timeout = self.pool.timeout
+
+    def request(self, *args, **kwargs):
+        http = self.pool.acquire()
+        # a connection broken by an exception is not returned to the pool
+        response = http.request(*args, **kwargs)
+        self.pool.release(http)
+        return response
+
+
+class PooledResponse(object):
+
+    ''' httplib.HTTPResponse of open_stream(), which gives back the connection
+        ---------------------------------------------------------------------
+
+    The http object goes back to the pool on close(). The connection is
+    kept alive, if the body has been read to the end.
+    '''
+
+    def __init__(self, response, connection, http, pool):
+        self.response = response
+        self.connection = connection
+        self.http = http
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def close(self):
+
+        if self.http is None:
+            return
+
+        if not self.response.isclosed():
+            # the rest of the body is in the socket
+            self.connection.close()
+
+        self.response.close()
+        self.pool.release(self.http)
+        self.http = None
+
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+_pool = None
+_pool_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def get_pool():
+    ''' Process-wide HttpPool, configured by settings:
+        GDRIVE_HTTP_POOL_SIZE, GDRIVE_HTTP_TIMEOUT
+    '''
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+
+            if _pool is None:
+                _pool = HttpPool(getattr(settings, 'GDRIVE_HTTP_POOL_SIZE', 10),
+                                 getattr(settings, 'GDRIVE_HTTP_TIMEOUT', None))
+
+    return _pool
+
+
+def get_discovery_document(api, version):
+    ''' Discovery document, fetched once per process '''
+
+    uri = getattr(settings, 'GDRIVE_DISCOVERY_URI', discovery.DISCOVERY_URI)
+    uri = uri.replace('{api}', api).replace('{apiVersion}', version)
+
+    if uri not in _documents:
+        with _documents_lock:
+
+            if uri not in _documents:
+                (resp, content) = PooledHttp().request(uri, 'GET')
+
+                if resp.status >= 400:
+                    raise errors.HttpError(resp, content, uri=uri)
+
+                _documents[uri] = content
+
+    return _documents[uri]
+
+
+def build_service(api, version, http):
+    ''' discovery.build() replacement, which does not fetch the document '''
+
+    return discovery.build_from_document(get_discovery_document(api, version), http=http)
+
+
+def open_stream(credentials, uri, method='GET', body=None, headers=None, lock=None,
+                pool=None):
+    ''' Unbuffered authorized request
+        ----------------------------
+
+    httplib2 reads the whole body into memory, here the caller reads the
+    returned response from the socket and closes it. The connection is
+    taken from an httplib2.Http of the pool and given back on close(), so
+    streams reuse keep-alive connections of API calls.
+
+    Redirects are followed. The token is refreshed once on 401 under the
+    lock (GDrive._lock), unless another thread has refreshed it meanwhile.
+    '''
+
+    pool = pool or get_pool()
+    refreshed = False
+    redirects = 0
+
+    while True:
+        request_headers = dict(headers or {})
+        token = credentials.access_token
+        credentials.apply(request_headers)
+        response = _request(pool, uri, method, body, request_headers)
+        location = response.getheader('location')
+        redirect = (response.status in REDIRECT_STATUSES and location and
+                    redirects < MAX_REDIRECTS)
+        unauthorized = (response.status == 401 and not refreshed and
+                        credentials.refresh_token is not None)
+
+        if not redirect and not unauthorized:
+            return response
+
+        # the connection is reused by the next request, once the body is read
+        response.read()
+        response.close()
+
+        if redirect:
+            uri = urlparse.urljoin(uri, location)
+            redirects += 1
+
+            if response.status == 303:
+                method, body = 'GET', None
+
+            continue
+
+        refreshed = True
+
+        with lock or _refresh_lock:
+
+            if credentials.access_token == token:
+                credentials.refresh(PooledHttp(pool))
+
+
+def _connection(http, scheme, netloc):
+    # kept by httplib2.Http, where its own requests find it
+    key = '%s:%s' % (scheme, netloc)
+
+    if key not in http.connections:
+
+        if scheme == 'https':
+            http.connections[key] = httplib2.HTTPSConnectionWithTimeout(
+                netloc, timeout=http.timeout, ca_certs=http.ca_certs,
+                disable_ssl_certificate_validation=http.disable_ssl_certificate_validation)
+        else:
+            http.connections[key] = httplib2.HTTPConnectionWithTimeout(
+                netloc, timeout=http.timeout)
+
+    return http.connections[key]
+
+
+def _request(pool, uri, method, body, headers):
+    parts = urlparse.urlsplit(uri)
+    path = parts.query and '%s?%s' % (parts.path, parts.query) or parts.path
+    http = pool.acquire()
+
+    for attempt in (0, 1):
+        connection = _connection(http, parts.scheme, parts.netloc)
+        reused = connection.sock is not None
+
+        try:
+            connection.request(method, path, body, headers)
+            return PooledResponse(connection.getresponse(), connection, http, pool)
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+
+            # a kept-alive connection may be closed by the server, it is tried again
+            if attempt or not reused:
+                pool.release(http)
+                raise
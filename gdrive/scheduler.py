@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+import threading
+import time
+
+from apiclient import errors
+
+from django.conf import settings
+
+from cache import LRUCache
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+class TokenBucket(object):
+
+    ''' Token bucket rate limiter
+        -------------------------
+
+    Arguments:
+        rate: tokens per second.
+        capacity: burst size, rate by default.
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        ''' Take a token, wait for it if necessary
+
+        Returns:
+            seconds of waiting.
+        '''
+
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0.0
+
+            # the token is reserved, the debt is paid by waiting
+            wait = -self.tokens / self.rate
+
+        time.sleep(wait)
+        return wait
+
+
+class Scheduler(object):
+
+    ''' Rate limits and retries of Google API calls
+        -------------------------------------------
+
+    Every call takes a token from the project bucket and from the bucket
+    of the user, buckets of max_users recently active users are kept.
+    Rate limit errors (403 userRateLimitExceeded, rateLimitExceeded, 429)
+    are retried with exponential backoff and jitter, 5xx only if the call
+    is idempotent: a failed POST may have been done.
+
+    Read more:
+        https://developers.google.com/drive/v2/web/handle-errors
+    '''
+
+    retry_statuses = (500, 502, 503, 504)
+    rate_limit_statuses = (429,)
+    rate_limit_reasons = ('userRateLimitExceeded', 'rateLimitExceeded')
+
+    def __init__(self, user_rate=10, project_rate=100, max_retries=5, max_delay=64,
+                 max_users=10000):
+        self.user_rate = user_rate
+        self.project_rate = project_rate
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.project_bucket = TokenBucket(project_rate)
+        self.user_buckets = LRUCache(max_users)
+        self.counters = {
+            'calls': 0,
+            'retries': 0,
+            'failures': 0,
+            'throttled': 0,
+            'throttled_seconds': 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def stats(self):
+
+        with self._lock:
+            return dict(self.counters)
+
+    def call(self, func, user=None, idempotent=True):
+        ''' Call func() within the limits, retry it on temporary errors
+
+        func raises apiclient.errors.HttpError on failure, 5xx errors are
+        not retried, if the call is not idempotent.
+        '''
+
+        attempt = 0
+
+        while True:
+            self.throttle(user)
+
+            try:
+                return func()
+            except errors.HttpError, error:
+
+                if error.resp.status < 400:
+                    # e.g. 304 of a conditional request is not a failure
+                    raise
+
+                if attempt >= self.max_retries or not self.is_retryable(error, idempotent):
+                    self.count('failures')
+                    raise
+
+            self.count('retries')
+            self.backoff(attempt)
+            attempt += 1
+
+    def throttle(self, user=None):
+        wait = self.project_bucket.acquire()
+
+        if user is not None:
+            wait += self._user_bucket(user).acquire()
+
+        with self._lock:
+            self.counters['calls'] += 1
+
+            if wait:
+                self.counters['throttled'] += 1
+                self.counters['throttled_seconds'] += wait
+
+    def backoff(self, attempt):
+        time.sleep(min(self.max_delay, 2 ** attempt) + random.random())
+
+    def is_retryable(self, error, idempotent=True):
+        status = error.resp.status
+
+        if status in self.rate_limit_statuses:
+            return True
+
+        if status in self.retry_statuses:
+            return idempotent
+
+        if status == 403:
+
+            try:
+                reasons = [e.get('reason') for e in
+                           json.loads(error.content)['error'].get('errors', [])]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return False
+
+            return any(r in self.rate_limit_reasons for r in reasons)
+
+        return False
+
+    def count(self, name):
+        ''' Add one to the counter, e.g. 'retries' of a batch part '''
+
+        with self._lock:
+            self.counters[name] += 1
+
+    def _user_bucket(self, user):
+
+        with self._lock:
+            bucket = self.user_buckets.get(user)
+
+            if bucket is None:
+                bucket = TokenBucket(self.user_rate)
+                self.user_buckets.set(user, bucket)
+
+            return bucket
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    ''' Process-wide Scheduler, configured by settings:
+        GDRIVE_USER_RATE, GDRIVE_PROJECT_RATE, GDRIVE_MAX_RETRIES,
+        GDRIVE_SCHEDULER_USERS
+    '''
+    global _scheduler
+
+    if _scheduler is None:
+        with _scheduler_lock:
+
+            if _scheduler is None:
+                _scheduler = Scheduler(getattr(settings, 'GDRIVE_USER_RATE', 10),
+                                       getattr(settings, 'GDRIVE_PROJECT_RATE', 100),
+                                       getattr(settings, 'GDRIVE_MAX_RETRIES', 5),
+                                       max_users=getattr(settings, 'GDRIVE_SCHEDULER_USERS',
+                                                         10000))
+
+    return _scheduler
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+from atom import ATOM_UPDATED
+from atom import BATCH_ID
+from atom import BATCH_STATUS
+from atom import GS_CELL
+from atom import edit_link
+from atom import entry_id
+from atom import iter_feed
+from atom import parse_key
+
+
+# result of a single cell update, status is the HTTP code of the operation
+CellResult = namedtuple('CellResult', ['key', 'value', 'ok', 'status', 'reason'])
+
+
+def bounds(keys):
+    ''' Range (min_row, max_row, min_col, max_col) of R1C1 keys '''
+
+    coords = [parse_key(k) for k in keys]
+    rows = [c[0] for c in coords]
+    cols = [c[1] for c in coords]
+    return min(rows), max(rows), min(cols), max(cols)
+
+
+class CellCache(object):
+
+    ''' Edit links, versions and values of worksheet cells
+        --------------------------------------------------
+
+    Filled from cells feeds, so only the cells which were fetched are
+    known. updated is the timestamp of the last full or incremental fetch,
+    use it as updated-min of the next one.
+    '''
+
+    def __init__(self):
+        self.cells = {}
+        self.updated = None
+
+    def __contains__(self, key):
+        return key in self.cells
+
+    def __len__(self):
+        return len(self.cells)
+
+    def get(self, key, default=None):
+        return self.cells.get(key, default)
+
+    def edit_link(self, key):
+        cell = self.cells.get(key)
+        return cell and cell['edit'] or ''
+
+    def missing(self, keys):
+        return [k for k in keys if k not in self.cells]
+
+    def clear(self):
+        self.cells = {}
+        self.updated = None
+
+    def update(self, source, stamp=True):
+        ''' Merge cells feed (or batch response) into the cache
+
+        Arguments:
+            source: XML string or response stream of the feed.
+            stamp: take the feed updated timestamp, False for responses
+                which do not reflect the whole worksheet state.
+        '''
+
+        for kind, entry in iter_feed(source):
+
+            if kind == 'updated':
+                # entry is the feed timestamp here
+                if stamp:
+                    self.updated = entry
+
+                continue
+
+            edit = edit_link(entry)
+            cell = entry.find(GS_CELL)
+
+            if edit is None or cell is None:
+                continue
+
+            self.cells[entry_id(entry)] = {
+                'edit': edit,
+                'version': edit.split('/')[-1],
+                'value': cell.get('inputValue'),
+                'updated': entry.findtext(ATOM_UPDATED),
+            }
+
+
+def parse_batch_response(source, items):
+    ''' CellResult for every (key, value) of the batch
+
+    Operations are matched by batch:id, which is A<n> for the n-th item.
+    '''
+
+    statuses = {}
+
+    for kind, entry in iter_feed(source):
+
+        if kind != 'entry':
+            continue
+
+        batch_id = entry.findtext(BATCH_ID)
+        status = entry.find(BATCH_STATUS)
+
+        if batch_id is not None and status is not None:
+            statuses[batch_id] = (int(status.get('code')), status.get('reason'))
+
+    results = []
+
+    for i, (key, value) in enumerate(items, 1):
+        code, reason = statuses.get('A%d' % i, (None, 'No response for the cell'))
+        results += [CellResult(key, value, code is not None and code < 300, code, reason)]
+
+    return results
+
+
+class WorksheetIndex(object):
+
+    ''' Worksheets of a spreadsheet by id and by title
+        ----------------------------------------------
+
+    Behaves like the list of worksheets it used to be, lookups by title
+    and by id are O(1). version is the ETag of the worksheets feed, which
+    the index was built from.
+    '''
+
+    def __init__(self, worksheets=(), version=None):
+        self.version = version
+        self._list = []
+        self._by_id = {}
+        self._by_title = {}
+        # titles as they were indexed, a worksheet title may be changed before save()
+        self._titles = {}
+
+        for w in worksheets:
+            self.add(w)
+
+    def __iter__(self):
+        return iter(self._list)
+
+    def __len__(self):
+        return len(self._list)
+
+    def __getitem__(self, i):
+        return self._list[i]
+
+    def __eq__(self, other):
+        return self is other or list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get_by_id(self, id):
+        return self._by_id.get(id)
+
+    def get_by_title(self, title):
+        return self._by_title.get(title)
+
+    def add(self, w):
+        self._list += [w]
+        self._index(w)
+
+    def remove(self, w):
+        self._list = [i for i in self._list if i is not w]
+        self._unindex(w)
+
+    def reindex(self, w):
+        ''' Take the new title of the saved worksheet, keeps the order '''
+
+        old = self._by_id.get(w.get_id(), w)
+        self._unindex(old)
+
+        if any(i is old for i in self._list):
+            self._list = [i is old and w or i for i in self._list]
+        else:
+            self._list += [w]
+
+        self._index(w)
+
+    def _index(self, w):
+        self._by_title[w.title] = w
+        self._titles[id(w)] = w.title
+
+        if w.get_id() is not None:
+            self._by_id[w.get_id()] = w
+
+    def _unindex(self, w):
+        title = self._titles.pop(id(w), None)
+
+        if self._by_title.get(title) is w:
+            del self._by_title[title]
+
+        if self._by_id.get(w.get_id()) is w:
+            del self._by_id[w.get_id()]
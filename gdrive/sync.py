@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+from bicycle.gdrive import GFactory
+from bicycle.gdrive import GFolder
+
+
+class IndexBase(object):
+
+    ''' Storage of GSync state
+        ----------------------
+
+    Keeps the start page token of the changes feed and the index of synced
+    files: {file_id: (parents, modified_date)}.
+    '''
+
+    def get_token(self):
+        raise NotImplementedError()
+
+    def set_token(self, token):
+        raise NotImplementedError()
+
+    def get(self, file_id):
+        ''' (parents, modified_date) or None '''
+        raise NotImplementedError()
+
+    def put(self, file_id, parents, modified_date):
+        raise NotImplementedError()
+
+    def delete(self, file_id):
+        raise NotImplementedError()
+
+    def children(self, file_id):
+        raise NotImplementedError()
+
+    def __contains__(self, file_id):
+        return self.get(file_id) is not None
+
+
+class DictIndex(IndexBase):
+
+    ''' In-memory index, pickle it to keep between runs '''
+
+    def __init__(self):
+        self.token = None
+        self.files = {}
+
+    def get_token(self):
+        return self.token
+
+    def set_token(self, token):
+        self.token = token
+
+    def get(self, file_id):
+        return self.files.get(file_id)
+
+    def put(self, file_id, parents, modified_date):
+        self.files[file_id] = (parents, modified_date)
+
+    def delete(self, file_id):
+        self.files.pop(file_id, None)
+
+    def children(self, file_id):
+        return [k for k, (parents, modified) in self.files.iteritems() if file_id in parents]
+
+
+class ModelIndex(IndexBase):
+
+    ''' Index in the Django models
+        --------------------------
+
+    Arguments:
+        state_model: subclass of models.GSyncStateModelBase.
+        file_model: subclass of models.GFileIndexModelBase.
+        root_id: id of the synced folder.
+    '''
+
+    def __init__(self, state_model, file_model, root_id):
+        self.state, created = state_model.objects.get_or_create(root_id=root_id)
+        self.file_model = file_model
+
+    def get_token(self):
+        return self.state.page_token
+
+    def set_token(self, token):
+        self.state.page_token = token
+        self.state.save(update_fields=['page_token'])
+
+    def get(self, file_id):
+
+        try:
+            obj = self.file_model.objects.get(file_id=file_id)
+        except self.file_model.DoesNotExist:
+            return None
+
+        return obj.get_parents(), obj.modified_date
+
+    def put(self, file_id, parents, modified_date):
+        self.file_model.objects.update_or_create(file_id=file_id, defaults={
+            'parents': ','.join(parents),
+            'modified_date': modified_date,
+        })
+
+    def delete(self, file_id):
+        self.file_model.objects.filter(file_id=file_id).delete()
+
+    def children(self, file_id):
+        qs = self.file_model.objects.filter(parents__contains=file_id)
+        return [obj.file_id for obj in qs if file_id in obj.get_parents()]
+
+
+class GSync(object):
+
+    ''' Incremental mirror of a Drive folder tree
+        -----------------------------------------
+
+    The first run lists the whole tree, every next one applies only the
+    changes feed since the stored start page token. Override on_change()
+    and on_delete() to mirror files into the database.
+
+    Usage:
+    ::
+        GSync(gdrive, ModelIndex(SyncState, FileIndex, folder_id), folder_id).run()
+
+    Read more:
+        https://developers.google.com/drive/v2/web/manage-changes
+    '''
+
+    fields = 'id,title,mimeType,parents(id),modifiedDate,labels/trashed'
+    page_size = 1000
+
+    def __init__(self, gdrive, index, root_id='root'):
+        self.gdrive = gdrive
+        self.index = index
+        self.root_id = root_id
+
+    def on_change(self, obj):
+        ''' Hook: G<FileType> object was added or changed in the tree '''
+        pass
+
+    def on_delete(self, file_id):
+        ''' Hook: file was deleted, trashed or moved out of the tree '''
+        pass
+
+    def run(self):
+        ''' Sync the tree, returns count of applied changes '''
+
+        # 'root' is an alias, parents of files refer to the real id
+        self.root_id = self.gdrive.execute(
+            self.gdrive.service.files().get(fileId=self.root_id, fields='id'))['id']
+
+        if self.index.get_token() is None:
+            return self.full()
+        else:
+            return self.incremental()
+
+    def full(self):
+        ''' List the whole tree and take the start page token '''
+
+        # the token is taken first, so changes made during listing are not lost
+        token = self.gdrive.execute(self.gdrive.service.changes().getStartPageToken())
+        count = self._crawl(self.root_id)
+        self.index.set_token(token['startPageToken'])
+        return count
+
+    def incremental(self):
+        ''' Apply the changes feed since the stored token '''
+
+        page_token = self.index.get_token()
+        count = 0
+
+        while True:
+            request = self.gdrive.service.changes().list(
+                pageToken=page_token, includeDeleted=True, maxResults=self.page_size,
+                fields='nextPageToken,newStartPageToken,items(fileId,deleted,file(%s))' %
+                self.fields)
+            results = self.gdrive.execute(request)
+
+            for change in results.get('items', []):
+                count += self._apply(change)
+
+            if 'newStartPageToken' in results:
+                self.index.set_token(results['newStartPageToken'])
+                return count
+
+            page_token = results['nextPageToken']
+            # a failed run goes on from the last applied page
+            self.index.set_token(page_token)
+
+    ###################
+    # Private methods #
+    ###################
+    def _crawl(self, folder_id):
+        count = 0
+        folders = [folder_id]
+
+        while folders:
+            q = "'%s' in parents and trashed = false" % folders.pop()
+
+            for obj in GFactory.filter(self.gdrive, page_size=self.page_size,
+                                       fields=self.fields, q=q):
+                self._put(obj)
+                count += 1
+
+                if isinstance(obj, GFolder):
+                    folders += [obj.get_id()]
+
+        return count
+
+    def _put(self, obj):
+        item = obj.get_raw()
+        parents = [p['id'] for p in item.get('parents', [])]
+        self.index.put(obj.get_id(), parents, item.get('modifiedDate', ''))
+        self.on_change(obj)
+
+    def _remove(self, file_id):
+        removed = 0
+        stack = [file_id]
+
+        while stack:
+            current = stack.pop()
+            stack += self.index.children(current)
+            self.index.delete(current)
+            self.on_delete(current)
+            removed += 1
+
+        return removed
+
+    def _apply(self, change):
+        file_id = change['fileId']
+        item = change.get('file')
+
+        if change.get('deleted') or item is None or item.get('labels', {}).get('trashed'):
+            return file_id in self.index and self._remove(file_id) or 0
+
+        parents = [p['id'] for p in item.get('parents', [])]
+        known = file_id in self.index
+
+        if not any(p == self.root_id or p in self.index for p in parents):
+            # moved out of the tree or has never been in it
+            return known and self._remove(file_id) or 0
+
+        obj = GFactory(self.gdrive, item)
+        self._put(obj)
+
+        if not known and isinstance(obj, GFolder):
+            # a folder moved into the tree brings its content with it
+            return 1 + self._crawl(file_id)
+
+        return 1
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import time
+
+from apiclient import errors
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+CHUNKSIZE = getattr(settings, 'GDRIVE_UPLOAD_CHUNKSIZE', 10 * 1024 * 1024)
+
+
+class UploadStats(object):
+
+    ''' Progress and throughput of a single upload
+        ------------------------------------------
+
+    Passed to a progress callback after every chunk.
+    '''
+
+    def __init__(self, filename, total_size):
+        self.filename = filename
+        self.total_size = total_size
+        self.bytes_sent = 0
+        self.resumed_from = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rate(self):
+        ''' Bytes per second sent by this process '''
+
+        if not self.elapsed:
+            return 0.0
+
+        return (self.bytes_sent - self.resumed_from) / self.elapsed
+
+    def progress(self):
+
+        if not self.total_size:
+            return 1.0
+
+        return float(self.bytes_sent) / self.total_size
+
+
+class SessionStore(object):
+
+    ''' Resumable upload URIs in the Django cache
+        -----------------------------------------
+
+    Google keeps an upload session for a week, so an interrupted upload
+    continues from the last received byte even after a process restart.
+    '''
+
+    prefix = 'gdrive:upload:'
+    timeout = 7 * 24 * 3600
+
+    def __init__(self, cache=cache):
+        self.cache = cache
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, uri):
+        self.cache.set(self.prefix + key, uri, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+
+def session_key(filename, *args):
+    ''' Key of an upload session: the file state plus target metadata '''
+
+    stat = os.stat(filename)
+    parts = [os.path.abspath(filename), stat.st_size, stat.st_mtime] + list(args)
+    return hashlib.md5(repr(parts)).hexdigest()
+
+
+def resumable_execute(http, request, key=None, progress=None, store=None, call=None):
+    ''' Execute resumable media request chunk by chunk
+        ----------------------------------------------
+
+    Arguments:
+        http: authorized http object.
+        request: apiclient HttpRequest with resumable media body.
+        key: upload session key, see session_key(), None to not resume.
+        progress: callable, gets UploadStats after every chunk.
+        store: SessionStore.
+        call: callable, which calls a function with retries, e.g.
+            Scheduler.call, every chunk is sent through it.
+
+    Returns:
+        Response of the last chunk.
+    '''
+
+    store = store or SessionStore()
+    call = call or (lambda func: func())
+    # only MediaFileUpload has a file name, apiclient keeps it private
+    stats = UploadStats(getattr(request.resumable, '_filename', None),
+                        request.resumable.size())
+    uri = key and store.get(key)
+
+    if uri:
+        # apiclient asks the server for the received range before the next chunk
+        request.resumable_uri = uri
+        request._in_error_state = True
+
+    response = None
+
+    while response is None:
+        try:
+            status, response = call(lambda: request.next_chunk(http=http))
+        except errors.HttpError, error:
+
+            if not uri or error.resp.status not in (404, 410):
+                raise
+
+            # the session has expired, start from scratch
+            store.delete(key)
+            uri = request.resumable_uri = None
+            request.resumable_progress = 0
+            request._in_error_state = False
+            continue
+
+        if key and request.resumable_uri and request.resumable_uri != uri:
+            uri = request.resumable_uri
+            store.set(key, uri)
+
+        if status is not None:
+
+            if not stats.bytes_sent:
+                # bytes received by the server before this process
+                stats.resumed_from = max(
+                    0, status.resumable_progress - request.resumable.chunksize())
+
+            stats.bytes_sent = status.resumable_progress
+
+            if progress is not None:
+                progress(stats)
+
+    if key:
+        store.delete(key)
+
+    stats.bytes_sent = stats.total_size
+    stats.finished = time.time()
+
+    if progress is not None:
+        progress(stats)
+
+    return response
@@ -2,6 +2,7 @@
 
 from django.conf.urls import patterns
 
+from views import JobStatusView
 from views import OAuthView
 from views import TestsView
 
@@ -9,6 +10,7 @@ from views import TestsView
 urlpatterns = patterns(
     '',
 
+    (r'jobs/(?P<job_id>[\w-]+)/$', JobStatusView.as_view()),
     (r'oauth/$', OAuthView.as_view()),
     (r'tests/$', TestsView.as_view()),
 )
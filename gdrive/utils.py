@@ -1,10 +1,63 @@
 # -*- coding: utf-8 -*-
 
-import re
+import sys
+import threading
+import Queue
 
 
-def get_xml_ns(content):
-    mutches = re.findall(r'xmlns\:?([^=]*?)=("(.+?)"|\'(.+?)\')', content, re.MULTILINE)
-    ns = {i[0]: i[2] or i[3] for i in mutches}
-    ns['default'] = ns['']
-    return ns
+def prefetch(iterable, size=1):
+    ''' Iterate over iterable in a background thread
+        --------------------------------------------
+
+    Up to size items are produced ahead of the consumer, so a slow
+    producer (e.g. a paginated API) works while the caller is busy with
+    the current item. Exceptions of the producer are re-raised in the
+    consumer thread.
+    '''
+
+    queue = Queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def produce():
+
+        try:
+            for item in iterable:
+
+                if not put((item, None)):
+                    return
+
+        except Exception:
+            put((done, sys.exc_info()))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            item, exc_info = queue.get()
+
+            if item is done:
+
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+
+                return
+
+            yield item
+    finally:
+        stop.set()
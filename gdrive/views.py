@@ -4,26 +4,27 @@ import datetime
 import dateutil.parser
 
 from django.conf import settings
+from django.http import Http404
 from django.shortcuts import redirect
 from django.views.generic.base import View
 
 from apiclient import errors
 from oauth2client import client
-from oauth2client.client import OAuth2Credentials
 from oauth2client.client import FlowExchangeError
 
 from bicycle.core.tools import localize_date
 from bicycle.core.views import JsonResponseMixin
 from bicycle.core.views import ResponseMixin
 
-from __init__ import GDoc
-from __init__ import GDrive
-from __init__ import GError
-from __init__ import GFactory
-from __init__ import GFile
-from __init__ import GFolder
-from __init__ import GSheet
-from __init__ import GWorkSheet
+from bicycle.gdrive import GDoc
+from bicycle.gdrive import GDrive
+from bicycle.gdrive import GError
+from bicycle.gdrive import GFactory
+from bicycle.gdrive import GFile
+from bicycle.gdrive import GFolder
+from bicycle.gdrive import GSheet
+from bicycle.gdrive import GWorkSheet
+from bicycle.gdrive.jobs import job_status
 
 
 def flow_arguments():
@@ -64,9 +65,10 @@ class OAuthMixin(object):
         if 'gdrive_oauth_credentials' not in request.session:
             return first_step()
         else:
-            credentials = OAuth2Credentials.from_json(request.session['gdrive_oauth_credentials'])
+            # the token is refreshed ahead by the cache, if it is possible
+            self.gdrive = GDrive.for_request(request)
 
-            if credentials.access_token_expired:
+            if self.gdrive is None or self.gdrive.credentials.access_token_expired:
                 del request.session['gdrive_oauth_credentials']
                 request.session.modified = True
                 return first_step()
@@ -107,10 +109,23 @@ class OAuthView(View):
             raise GError(error)
 
 
+class JobStatusView(OAuthMixin, JsonResponseMixin, View):
+
+    ''' JSON status of a background job, see jobs.enqueue() '''
+
+    def get(self, request, job_id):
+        data = job_status(job_id, self.gdrive.user_key)
+
+        if data is None:
+            raise Http404
+
+        return self.json_response(data)
+
+
 class TestsView(OAuthMixin, JsonResponseMixin, View):
 
     def __prepare_tests(self, request):
-        self.gdrive = GDrive(request)
+        self.gdrive = GDrive.for_request(request)
         self.errors = []
 
     def __response(self):
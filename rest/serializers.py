@@ -59,26 +59,77 @@ class CamelCaseJSONSerializer(Serializer):
         return underscored_data
 
 
-def serialize_queryset(resource_class, queryset, is_search_queryset=False):
+def resource_querysets(resource):
+    # the resource queryset, with its select_related and prefetch_related
+    queryset = getattr(resource._meta, 'queryset', None)
+    if queryset is None:
+        return {}
+    return {queryset.model: queryset._clone()}
+
+
+def load_search_objects(results, querysets=None):
+    ''' Model objects of search results, a query per model
+        --------------------------------------------------
+
+    Hits are grouped by model and every group is loaded by in_bulk() of
+    the queryset from querysets dict, or of the search index
+    read_queryset(). result.object is set, so it does not make a query
+    of its own.
+
+    Returns:
+        list of objects in the order of results, hits of deleted objects
+        are skipped.
+    '''
+    from haystack.exceptions import NotHandled
+
+    results = [r for r in results if r is not None and r.model is not None]
+    querysets = querysets or {}
+    groups = {}
+    for r in results:
+        groups.setdefault(r.model, []).append(r)
+
+    loaded = {}
+    for model, group in groups.items():
+        queryset = querysets.get(model)
+        if queryset is None:
+            try:
+                queryset = group[0].searchindex.read_queryset()
+            except NotHandled:
+                queryset = model._default_manager.all()
+        # search result pk is a string
+        objects = queryset.in_bulk([r.pk for r in group])
+        loaded[model] = dict((unicode(pk), obj) for pk, obj in objects.items())
+
+    objects = []
+    for r in results:
+        obj = loaded[r.model].get(unicode(r.pk))
+        if obj is not None:
+            r.object = obj
+            objects.append(obj)
+    return objects
+
+
+def serialize_queryset(resource_class, queryset, is_search_queryset=False,
+                       limit=1000, offset=0, resource_uri=None):
     # hand me a queryset, i give you dehydrated resources
     resource = resource_class()
     dd = {}
 
-    # make meta
-    dd['meta'] = {}
-    dd['meta']['limit'] = 1000
-    dd['meta']['next'] = None
-    dd['meta']['offset'] = 0
-    dd['meta']['previous'] = None
-    dd['meta']['total_count'] = len(queryset)
+    # make meta, the total count is asked by count(), only the page is loaded
+    paginator = resource._meta.paginator_class(
+        {}, queryset, resource_uri=resource_uri, limit=limit, offset=offset, max_limit=None)
+    page = paginator.page()
+    dd['meta'] = page['meta']
+    dd['meta'].setdefault('next', None)
+    dd['meta'].setdefault('previous', None)
 
     # objects
+    queryset = page['objects']
+    if is_search_queryset:
+        queryset = load_search_objects(queryset, resource_querysets(resource))
     dd['objects'] = []
     for obj in queryset:
-        if is_search_queryset:
-            bundle = resource.build_bundle(obj=obj.object)
-        else:
-            bundle = resource.build_bundle(obj=obj)
+        bundle = resource.build_bundle(obj=obj)
         dehydrated_obj = resource.full_dehydrate(bundle)
         dd['objects'].append(dehydrated_obj)
 
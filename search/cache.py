@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from haystack.models import SearchResult
+
+
+GENERATION_KEY = 'search:generation'
+ITER_CHUNKSIZE = 100
+
+
+class LRUCache(object):
+
+    ''' Thread-safe in-process LRU cache '''
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+
+        with self._lock:
+
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+
+
+def get_generation():
+    ''' Index generation, shared by processes through the Django cache '''
+
+    generation = cache.get(GENERATION_KEY)
+
+    if generation is None:
+        cache.add(GENERATION_KEY, 0, None)
+        generation = cache.get(GENERATION_KEY) or 0
+
+    return generation
+
+
+def bump_generation():
+    ''' Invalidate cached plans and results, call it after the index is updated '''
+
+    cache.add(GENERATION_KEY, 0, None)
+    return cache.incr(GENERATION_KEY)
+
+
+def normalize_query(query_string):
+    return u' '.join(query_string.split())
+
+
+result_cache = LRUCache(getattr(settings, 'SEARCH_RESULT_CACHE_SIZE', 1000))
+
+
+class CachedSearchQuerySet(object):
+
+    ''' Hits of a SearchQuerySet, cached by the query and the slice
+        -----------------------------------------------------------
+
+    Works like a SearchQuerySet for a Paginator, a ListView or a loop:
+    count() and slices. A slice is fetched from the backend once per
+    index generation, app_label, model_name, pk, score and the stored
+    fields (highlighted too) of the hits are kept, and SearchResult objects
+    are made of them again, so result.object works as usual. Negative
+    indexes are not supported, like by SearchQuerySet.
+
+    Usage:
+    ::
+        sqs = make_search_queryset(query)
+        hits = CachedSearchQuerySet(sqs, query)
+        page = Paginator(hits, 12).page(1)
+    '''
+
+    def __init__(self, queryset, query_string, cache=None):
+        self.queryset = queryset
+        self.cache = cache or result_cache
+        self._key = (get_generation(), type(queryset), normalize_query(query_string))
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        start = 0
+        count = self.count()
+
+        while start < count:
+            for result in self[start:start + ITER_CHUNKSIZE]:
+                yield result
+
+            start += ITER_CHUNKSIZE
+
+    def __getitem__(self, k):
+        assert ((not isinstance(k, slice) and k >= 0) or
+                (isinstance(k, slice) and (k.start is None or k.start >= 0) and
+                 (k.stop is None or k.stop >= 0))), 'Negative indexing is not supported.'
+
+        if not isinstance(k, slice):
+            results = self[k:k + 1]
+
+            if not results:
+                raise IndexError('Search result index out of range')
+
+            return results[0]
+
+        assert k.step is None, 'Slicing with step is not supported'
+        start = k.start or 0
+        stop = k.stop is None and self.count() or k.stop
+        key = self._key + (start, stop)
+        hits = self.cache.get(key)
+
+        if hits is None:
+            results = list(self.queryset[start:stop])
+            hits = [(r.app_label, r.model_name, r.pk, r.score, self._fields(r))
+                    for r in results if r is not None]
+            self.cache.set(key, hits)
+            # the count is known by the backend after the slice
+            self.cache.set(self._key + ('count',), self.queryset.count())
+
+        return [SearchResult(*hit[:4], **hit[4]) for hit in hits]
+
+    def count(self):
+        key = self._key + ('count',)
+        count = self.cache.get(key)
+
+        if count is None:
+            count = self.queryset.count()
+            self.cache.set(key, count)
+
+        return count
+
+    ###################
+    # Private methods #
+    ###################
+    @staticmethod
+    def _fields(result):
+        ''' Stored fields and highlighted of the result, made by the backend '''
+
+        return dict((str(name), getattr(result, name)) for name in result._additional_fields)
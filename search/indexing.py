@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import time
+import uuid
+
+from django import db
+from django.apps import apps
+from django.conf import settings
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+from haystack.exceptions import NotHandled
+import django_rq
+
+from cache import bump_generation
+import suggest
+
+
+QUEUE = getattr(settings, 'SEARCH_RQ_QUEUE', 'default')
+BATCH_SIZE = getattr(settings, 'SEARCH_INDEX_BATCH_SIZE', 500)
+LOCK_TIMEOUT = getattr(settings, 'SEARCH_INDEX_LOCK_TIMEOUT', 6 * 60 * 60)
+# seconds a rebuild waits for the lock, before it is left pending
+REBUILD_WAIT = getattr(settings, 'SEARCH_REBUILD_WAIT', 60)
+# processes of a full rebuild, every one writes its own shard
+WORKERS = getattr(settings, 'SEARCH_INDEX_WORKERS', 1)
+XAPIAN_COMPACT = getattr(settings, 'SEARCH_XAPIAN_COMPACT', 'xapian-compact')
+
+QUEUE_KEY = 'search:index:queue'
+LOCK_KEY = 'search:index:lock'
+PROCESS_SCHEDULED_KEY = 'search:index:process-scheduled'
+REBUILD_SCHEDULED_KEY = 'search:index:rebuild-scheduled'
+REBUILD_PENDING_KEY = 'search:index:rebuild-pending'
+
+PROCESS_JOB = 'bicycle.searchextensions.jobs.process_index_queue'
+REBUILD_JOB = 'bicycle.searchextensions.jobs.update_index'
+
+RELEASE_SCRIPT = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+'''
+
+
+def get_connection():
+    return django_rq.get_connection(QUEUE)
+
+
+class IndexLock(object):
+
+    ''' Redis lock of the search index, a single writer at a time
+        ----------------------------------------------------------
+
+    It expires in timeout seconds, if the worker dies while holding it.
+    '''
+
+    def __init__(self, timeout=LOCK_TIMEOUT):
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.conn = get_connection()
+
+    def acquire(self, wait=0):
+        ''' True if the lock is taken, waits for it up to wait seconds '''
+
+        deadline = time.time() + wait
+
+        while not self.conn.set(LOCK_KEY, self.token, nx=True, ex=self.timeout):
+
+            if time.time() >= deadline:
+                return False
+
+            time.sleep(1)
+
+        return True
+
+    def release(self):
+        # only the owner deletes the lock
+        self.conn.eval(RELEASE_SCRIPT, 1, LOCK_KEY, self.token)
+
+
+def _schedule(func, flag):
+    # a job is enqueued once, until it starts (processing) or ends (rebuild)
+    if get_connection().set(flag, '1', nx=True, ex=LOCK_TIMEOUT):
+        return django_rq.get_queue(QUEUE).enqueue_call(func, timeout=LOCK_TIMEOUT)
+
+    return None
+
+
+def schedule_processing():
+    return _schedule(PROCESS_JOB, PROCESS_SCHEDULED_KEY)
+
+
+def schedule_rebuild():
+    return _schedule(REBUILD_JOB, REBUILD_SCHEDULED_KEY)
+
+
+def _reschedule(conn):
+    # the lock holder runs what has been asked meanwhile, after release
+    if conn.delete(REBUILD_PENDING_KEY):
+        schedule_rebuild()
+
+    if conn.llen(QUEUE_KEY):
+        schedule_processing()
+
+
+def record(identifiers):
+    ''' Put changed objects (haystack identifiers) to the index queue '''
+
+    if identifiers:
+        get_connection().rpush(QUEUE_KEY, *identifiers)
+        schedule_processing()
+
+
+def index_identifiers(identifiers, using=DEFAULT_ALIAS, backend=None):
+    ''' Update or remove the objects in the index
+        -----------------------------------------
+
+    Every model is loaded by a single query of index_queryset(), objects
+    which are not found there (deleted or filtered out) are removed.
+    '''
+
+    unified_index = connections[using].get_unified_index()
+    backend = backend or connections[using].get_backend()
+    groups = {}
+
+    for identifier in identifiers:
+        app_label, model_name, pk = identifier.split('.', 2)
+
+        try:
+            model = apps.get_model(app_label, model_name)
+        except LookupError:
+            continue
+
+        groups.setdefault(model, {})[pk] = identifier
+
+    for model, pks in groups.items():
+
+        try:
+            index = unified_index.get_index(model)
+        except NotHandled:
+            continue
+
+        objects = index.index_queryset(using=using).in_bulk(pks.keys())
+
+        if objects:
+            backend.update(index, objects.values())
+
+        found = set(unicode(pk) for pk in objects)
+
+        for pk, identifier in pks.items():
+
+            if pk not in found:
+                backend.remove(identifier)
+
+
+def process_queue(batch_size=BATCH_SIZE, using=DEFAULT_ALIAS):
+    ''' Index queued changes in batches until the queue is empty
+        ---------------------------------------------------------
+
+    Items are taken from the queue after their batch is indexed, so a
+    failed job leaves them for the next one.
+
+    Returns:
+        Number of processed items, None if another job holds the lock.
+    '''
+
+    conn = get_connection()
+    # changes recorded from now on need another job
+    conn.delete(PROCESS_SCHEDULED_KEY)
+    lock = IndexLock()
+
+    if not lock.acquire():
+        # the lock holder schedules the queue on release
+        return None
+
+    processed = 0
+
+    try:
+        while True:
+            items = conn.lrange(QUEUE_KEY, 0, batch_size - 1)
+
+            if not items:
+                break
+
+            index_identifiers(set(items), using)
+            conn.ltrim(QUEUE_KEY, len(items), -1)
+            processed += len(items)
+    finally:
+        lock.release()
+
+    if processed:
+        bump_generation()
+        suggest.build_if_stale(using)
+
+    _reschedule(conn)
+    return processed
+
+
+def build_index(index, backend, using=DEFAULT_ALIAS, batch_size=BATCH_SIZE, start=None,
+                end=None, progress=None):
+    ''' Write objects of the index to the backend in batches by pk
+        ----------------------------------------------------------
+
+    Arguments:
+        start, end: pk range, start < pk <= end, None for no limit.
+        progress: callable, gets the number of objects written so far.
+
+    Returns:
+        Number of objects written.
+    '''
+
+    queryset = index.build_queryset(using=using).order_by('pk')
+
+    if end is not None:
+        queryset = queryset.filter(pk__lte=end)
+
+    count = 0
+    last_pk = start
+
+    while True:
+        batch = queryset
+
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+
+        objects = list(batch[:batch_size])
+
+        if not objects:
+            break
+
+        backend.update(index, objects)
+        count += len(objects)
+        last_pk = objects[-1].pk
+
+        if progress is not None:
+            progress(count)
+
+    return count
+
+
+def shadow_backend(path, using=DEFAULT_ALIAS):
+    ''' Backend of the connection, which writes to another path '''
+
+    engine = connections[using]
+    options = dict(engine.options, PATH=path)
+    return engine.backend(using, **options)
+
+
+def swap(path, target):
+    ''' Point the index path to the target directory atomically
+        -------------------------------------------------------
+
+    The path becomes a symlink, which is replaced by rename(), so searches
+    open either the old or the new index. The old index is deleted.
+    '''
+
+    path = path.rstrip(os.sep)
+    link = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    os.symlink(os.path.relpath(target, os.path.dirname(path)), link)
+    old = None
+
+    if os.path.islink(path):
+        old = os.path.realpath(path)
+    elif os.path.isdir(path):
+        # the first swap, the directory is moved away
+        old = '%s.%s.old' % (path, uuid.uuid4().hex)
+        os.rename(path, old)
+
+    os.rename(link, path)
+
+    if old is not None and old != os.path.realpath(target):
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def reporter(callback, shard, model, start=None, end=None):
+    ''' Progress callable of build_index(), which passes events to the callback
+        ------------------------------------------------------------------------
+
+    An event is a dict of shard, model, start, end, count (objects written
+    so far), seconds and done, which is True in the last event of a range.
+    report(done=True) sends it with the last count.
+    '''
+
+    event = {
+        'shard': shard,
+        'model': model,
+        'start': start,
+        'end': end,
+        'count': 0,
+        'seconds': 0.0,
+        'done': False,
+    }
+    started = time.time()
+
+    def report(count=None, done=False):
+
+        if count is not None:
+            event['count'] = count
+
+        event['seconds'] = time.time() - started
+        event['done'] = done
+        callback(dict(event))
+
+    return report
+
+
+def build_all(backend, using=DEFAULT_ALIAS, batch_size=BATCH_SIZE, progress=None):
+    ''' Write all indexes of the connection, returns counts by model label
+
+    Arguments:
+        progress: callable, gets an event of reporter() after every batch.
+    '''
+
+    counts = {}
+
+    for model, index in connections[using].get_unified_index().get_indexes().items():
+        label = model_label(model)
+        report = progress is not None and reporter(progress, None, label) or None
+        counts[label] = build_index(index, backend, using, batch_size, progress=report)
+
+        if report is not None:
+            report(done=True)
+
+    return counts
+
+
+def split_range(index, parts, using=DEFAULT_ALIAS):
+    ''' List of (start, end) pk ranges of about the same size, which cover the index '''
+
+    pks = index.build_queryset(using=using).order_by('pk').values_list('pk', flat=True)
+    count = pks.count()
+
+    if not count:
+        return []
+
+    offsets = sorted(set(count * i // parts for i in range(1, parts)) - set([0]))
+    # the last pk of every part, a query per bound
+    bounds = [None] + [pks[offset - 1] for offset in offsets] + [None]
+    return zip(bounds[:-1], bounds[1:])
+
+
+# events of the worker process of build_sharded()
+_events = None
+
+
+def _init_worker(events):
+    global _events
+    _events = events
+
+
+def _build_shard(task):
+    # runs in a worker process of build_sharded()
+    label, start, end, path, using, batch_size = task
+    report = reporter(_events.put, os.path.basename(path), label, start, end)
+
+    try:
+        index = connections[using].get_unified_index().get_index(apps.get_model(label))
+        return build_index(index, shadow_backend(path, using), using, batch_size, start, end,
+                           report)
+    finally:
+        # build_sharded() waits for the last event of every shard
+        report(done=True)
+
+
+def merge(shards, target):
+    ''' Merge Xapian databases into the target one
+        ------------------------------------------
+
+    xapian-compact is used if it is installed, else documents and spelling
+    data are copied by the xapian bindings. Document ids are renumbered,
+    the backend finds documents by their identifier terms.
+    '''
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([XAPIAN_COMPACT] + list(shards) + [target], stdout=devnull)
+        return
+    except OSError:
+        # no xapian-compact
+        pass
+
+    import xapian
+
+    database = xapian.WritableDatabase(target, xapian.DB_CREATE_OR_OPEN)
+
+    for path in shards:
+        shard = xapian.Database(path)
+
+        for item in shard.postlist(''):
+            database.add_document(shard.get_document(item.docid))
+
+        for item in shard.spellings():
+            database.add_spelling(item.term, item.termfreq)
+
+        database.commit()
+
+    database.close()
+
+
+def build_sharded(path, workers, using=DEFAULT_ALIAS, batch_size=BATCH_SIZE, progress=None):
+    ''' Write all indexes of the connection by a pool of processes
+        -----------------------------------------------------------
+
+    Every model is split into pk ranges, one per worker. A range is
+    written to its own shard, shards are merged into the path at the end.
+
+    Events of reporter() are sent by workers through a multiprocessing
+    queue, so progress is reported after every batch of every shard.
+
+    Arguments:
+        progress: callable, gets an event of reporter() after every batch.
+
+    Returns:
+        Dict of written objects by model label.
+    '''
+
+    shards_path = '%s.shards' % path
+    counts = {}
+    tasks = []
+
+    for model, index in connections[using].get_unified_index().get_indexes().items():
+        counts[model_label(model)] = 0
+
+        for start, end in split_range(index, workers, using):
+            shard = os.path.join(shards_path, '%04d' % len(tasks))
+            tasks.append((model_label(model), start, end, shard, using, batch_size))
+
+    # forked workers must not share database connections of this process
+    for connection in db.connections.all():
+        connection.close()
+
+    events = multiprocessing.Queue()
+    pool = multiprocessing.Pool(workers, _init_worker, (events,))
+
+    try:
+        try:
+            results = pool.imap_unordered(_build_shard, tasks)
+            done = 0
+
+            while done < len(tasks):
+                event = events.get()
+
+                if event['done']:
+                    counts[event['model']] += event['count']
+                    done += 1
+
+                if progress is not None:
+                    progress(event)
+
+            # an error of a shard is raised here
+            list(results)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        # a range may be emptied meanwhile, its shard is not created
+        shards = [task[3] for task in tasks if os.path.isdir(task[3])]
+
+        if shards:
+            merge(shards, path)
+    finally:
+        shutil.rmtree(shards_path, ignore_errors=True)
+
+    return counts
+
+
+def rebuild(batch_size=BATCH_SIZE, using=DEFAULT_ALIAS, workers=WORKERS, progress=None):
+    ''' Full rebuild into a shadow index, which is swapped in
+        -----------------------------------------------------
+
+    The index is locked for the rebuild, changes recorded meanwhile are
+    indexed after the swap. If the lock is busy for REBUILD_WAIT seconds,
+    the rebuild is left pending and the lock holder schedules it on release.
+
+    Arguments:
+        workers: more than one builds the index by build_sharded().
+        progress: callable, gets an event of reporter() after every batch.
+
+    Returns:
+        Dict of written objects by model label, None if the lock is busy.
+    '''
+
+    conn = get_connection()
+    lock = IndexLock()
+
+    if not lock.acquire(wait=REBUILD_WAIT):
+        conn.delete(REBUILD_SCHEDULED_KEY)
+        conn.set(REBUILD_PENDING_KEY, '1', ex=LOCK_TIMEOUT)
+
+        # the holder may have released the lock before the flag was set
+        if not lock.acquire():
+            return None
+
+    conn.delete(REBUILD_PENDING_KEY)
+
+    try:
+        try:
+            path = connections[using].options['PATH'].rstrip(os.sep)
+            shadow = '%s.%s' % (path, time.strftime('%Y%m%d%H%M%S'))
+
+            try:
+                if workers > 1:
+                    counts = build_sharded(shadow, workers, using, batch_size, progress)
+                else:
+                    counts = build_all(shadow_backend(shadow, using), using, batch_size,
+                                       progress)
+            except Exception:
+                shutil.rmtree(shadow, ignore_errors=True)
+                raise
+
+            swap(path, shadow)
+        finally:
+            lock.release()
+    finally:
+        conn.delete(REBUILD_SCHEDULED_KEY)
+
+    bump_generation()
+    suggest.build(using)
+    _reschedule(conn)
+
+    return counts
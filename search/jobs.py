@@ -1,8 +1,12 @@
 # coding: UTF-8
 
 def update_index():
-    import sys
-    import codecs
-    from haystack.management.commands import update_index
-    sys.stdout = codecs.getwriter("utf-8")(sys.stdout)
-    update_index.Command().handle()
\ No newline at end of file
+    # full rebuild into a shadow index, swapped in when it is ready
+    from bicycle.searchextensions.indexing import rebuild
+    return rebuild()
+
+
+def process_index_queue():
+    # changes recorded by signals.QueuedSignalProcessor
+    from bicycle.searchextensions.indexing import process_queue
+    return process_queue()
@@ -0,0 +1,72 @@
+# coding: UTF-8
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils.encoding import force_str
+from django.utils.termcolors import make_style
+from haystack.constants import DEFAULT_ALIAS
+
+from bicycle.searchextensions.indexing import BATCH_SIZE
+from bicycle.searchextensions.indexing import WORKERS
+from bicycle.searchextensions.indexing import rebuild
+
+
+success = make_style(fg='green')
+notice = make_style(fg='yellow')
+
+
+def rate(count, seconds):
+    return seconds and count / seconds or 0.0
+
+
+def print_progress(event):
+    bounds = u'(%s, %s]' % (event['start'] or u'', event['end'] or u'')
+    print u'shard %s  %-24s %-20s %8d objects in %7.1fs, %8.1f objects/s%s' % (
+        notice(force_str(event['shard'] or u'-')), event['model'], bounds, event['count'],
+        event['seconds'], rate(event['count'], event['seconds']),
+        event['done'] and success(u'  done') or u'')
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=WORKERS,
+                    help='Processes, every one writes its own shard'),
+        make_option('--batch-size', type='int', default=BATCH_SIZE,
+                    help='Objects written to the index at once'),
+        make_option('--using', default=DEFAULT_ALIAS,
+                    help='Haystack connection'),
+    )
+
+    def handle(self, *args, **options):
+        ''' Full rebuild of the search index, swapped in when it is ready
+            -------------------------------------------------------------
+
+        Models are split into pk ranges, which are written to shards by
+        a pool of processes and merged. It is what jobs.update_index does,
+        but in the foreground and with a report per batch.
+
+        Usage:
+        ::
+            python manage.py rebuild_search_index --workers 8
+        '''
+
+        started = time.time()
+        counts = rebuild(options['batch_size'], options['using'], options['workers'],
+                         print_progress)
+
+        if counts is None:
+            raise CommandError('The index is locked by another job, '
+                               'it schedules the rebuild when it is done')
+
+        seconds = time.time() - started
+
+        for label, count in sorted(counts.items()):
+            print u'%-24s %8d objects' % (label, count)
+
+        total = sum(counts.values())
+        print success(u'%d objects in %.1fs, %.1f objects/s' % (
+            total, seconds, rate(total, seconds)))
@@ -24,6 +24,8 @@ HAYSTACK_CONNECTIONS = {
         'FLAGS': XAPIAN_FLAGS,
     },
 }
+# changes are indexed by rq jobs in batches, see searchextensions.indexing
+HAYSTACK_SIGNAL_PROCESSOR = 'bicycle.searchextensions.signals.QueuedSignalProcessor'
 HAYSTACK_SEARCH_RESULTS_PER_PAGE = 12
 HAYSTACK_XAPIAN_LANGUAGE = 'ru'
 HAYSTACK_DEFAULT_OPERATOR = 'OR'
\ No newline at end of file
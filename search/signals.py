@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+from django.db import models
+from django.db import transaction
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+from haystack.utils import get_identifier
+
+from indexing import record
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+
+    ''' Records saved and deleted objects to the index queue
+        ----------------------------------------------------
+
+    Nothing is indexed in the request: jobs.process_index_queue indexes
+    the queue in batches. Enable it in settings:
+    ::
+        HAYSTACK_SIGNAL_PROCESSOR = 'bicycle.searchextensions.signals.QueuedSignalProcessor'
+    '''
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, **kwargs):
+
+        if not self.is_indexed(sender, instance):
+            return
+
+        identifiers = [get_identifier(instance)]
+        on_commit = getattr(transaction, 'on_commit', None)
+
+        # the job should see the committed row, where Django can wait for it
+        if on_commit is not None:
+            on_commit(lambda: record(identifiers))
+        else:
+            record(identifiers)
+
+    # the job finds out, whether the object is still there
+    handle_delete = handle_save
+
+    def is_indexed(self, sender, instance):
+
+        for using in self.connection_router.for_write(instance=instance):
+
+            try:
+                self.connections[using].get_unified_index().get_index(sender)
+                return True
+            except NotHandled:
+                pass
+
+        return False
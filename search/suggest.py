@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import codecs
+import heapq
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+
+from cache import LRUCache
+
+try:
+    import xapian
+except ImportError:
+    xapian = None
+
+
+MIN_WEIGHT = getattr(settings, 'SEARCH_SUGGEST_MIN_WEIGHT', 1)
+LIMIT = getattr(settings, 'SEARCH_SUGGEST_LIMIT', 10)
+# seconds between builds after incremental updates of the index
+INTERVAL = getattr(settings, 'SEARCH_SUGGEST_INTERVAL', 60 * 60)
+
+
+def get_path(using=DEFAULT_ALIAS):
+    ''' File of the suggest terms, next to the index '''
+
+    path = getattr(settings, 'SEARCH_SUGGEST_PATH', None)
+
+    if path is None:
+        path = '%s.suggest' % connections[using].options['PATH'].rstrip(os.sep)
+
+    return path
+
+
+def index_terms(path):
+    ''' (term, weight) of the words of the Xapian database, sorted by term
+
+    Weight is the number of documents. Prefixed terms (fields, stems)
+    are skipped, the prefixes are upper case.
+    '''
+
+    database = xapian.Database(path)
+
+    for item in database.allterms():
+        term = item.term
+
+        if term[:1].isupper() or (term[:1] < '\x80' and not term[:1].isalnum()):
+            continue
+
+        if item.termfreq >= MIN_WEIGHT:
+            yield term.decode('utf-8'), item.termfreq
+
+
+def build(using=DEFAULT_ALIAS):
+    ''' Write terms of the index to the suggest file
+        --------------------------------------------
+
+    All terms of the index are read, call it after a full rebuild and
+    build_if_stale() after incremental updates. The file is replaced
+    atomically and the processes load it again.
+
+    Returns:
+        Number of terms, None without the xapian bindings.
+    '''
+
+    if xapian is None:
+        return None
+
+    path = get_path(using)
+    # jobs may build it at the same time, every one writes its own file
+    tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    count = 0
+
+    try:
+        with codecs.open(tmp, 'w', 'utf-8') as f:
+            for term, weight in index_terms(connections[using].options['PATH']):
+                f.write(u'%s\t%d\n' % (term, weight))
+                count += 1
+
+        os.rename(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    return count
+
+
+def build_if_stale(using=DEFAULT_ALIAS, interval=INTERVAL):
+    ''' build() if the suggest file is older than interval seconds
+
+    Returns:
+        Number of terms, None if the file is fresh or without the xapian
+        bindings.
+    '''
+
+    if xapian is None:
+        return None
+
+    try:
+        age = time.time() - os.stat(get_path(using)).st_mtime
+    except OSError:
+        age = None
+
+    if age is not None and age < interval:
+        return None
+
+    return build(using)
+
+
+class PrefixIndex(object):
+
+    ''' Terms of a sorted array, found by a prefix with bisect
+        ------------------------------------------------------
+
+    Terms of a prefix are a slice of the array, the heaviest of them
+    are the suggestions. Answers are kept in LRU cache, short prefixes
+    cover many terms.
+
+    Usage:
+    ::
+        index = PrefixIndex([(u'bicycle', 12), (u'bike', 30)])
+        index.suggest(u'bi')  # [u'bike', u'bicycle']
+    '''
+
+    def __init__(self, terms, cache_size=1000):
+        terms = sorted(terms)
+        self.terms = [term for term, weight in terms]
+        self.weights = [weight for term, weight in terms]
+        self.cache = LRUCache(cache_size)
+
+    def __len__(self):
+        return len(self.terms)
+
+    @classmethod
+    def load(cls, path):
+        terms = []
+
+        with codecs.open(path, 'r', 'utf-8') as f:
+            for line in f:
+                term, weight = line.rstrip(u'\n').rsplit(u'\t', 1)
+                terms.append((term, int(weight)))
+
+        return cls(terms)
+
+    def suggest(self, prefix, limit=LIMIT):
+        ''' Up to limit terms, which start with the prefix, heavier first '''
+
+        prefix = prefix.lower()
+        key = (prefix, limit)
+        result = self.cache.get(key)
+
+        if result is None:
+            start = bisect.bisect_left(self.terms, prefix)
+            end = bisect.bisect_left(self.terms, prefix + u'\uffff', start)
+            indexes = heapq.nlargest(limit, xrange(start, end), key=self.weights.__getitem__)
+            result = [self.terms[i] for i in indexes]
+            self.cache.set(key, result)
+
+        return result
+
+
+# path: (mtime, PrefixIndex), the tuple is replaced, when the file is loaded again
+_loaded = {}
+_reloading = set()
+_lock = threading.Lock()
+
+
+def _reload(path, mtime):
+
+    try:
+        _loaded[path] = (mtime, PrefixIndex.load(path))
+    finally:
+        with _lock:
+            _reloading.discard(path)
+
+
+def get_index(using=DEFAULT_ALIAS):
+    ''' PrefixIndex of the suggest file, loaded again when the file changes
+        -------------------------------------------------------------------
+
+    A changed file is loaded by a single background thread, requests are
+    answered by the loaded index meanwhile. Only the first load is waited
+    for.
+    '''
+
+    path = get_path(using)
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return PrefixIndex([])
+
+    loaded = _loaded.get(path)
+
+    if loaded is not None and loaded[0] == mtime:
+        return loaded[1]
+
+    with _lock:
+        loaded = _loaded.get(path)
+
+        if loaded is None:
+            loaded = _loaded[path] = (mtime, PrefixIndex.load(path))
+        elif loaded[0] != mtime and path not in _reloading:
+            _reloading.add(path)
+            thread = threading.Thread(target=_reload, args=(path, mtime))
+            thread.daemon = True
+            thread.start()
+
+    return loaded[1]
+
+
+def suggest(query_string, limit=LIMIT, using=DEFAULT_ALIAS):
+    ''' Completions of the last word of the query, with the words before it '''
+
+    words = query_string.split()
+
+    if not words or query_string[-1:].isspace():
+        return []
+
+    head = u' '.join(words[:-1])
+    return [u' '.join(filter(None, [head, term]))
+            for term in get_index(using).suggest(words[-1], limit)]
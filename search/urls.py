@@ -6,4 +6,5 @@ from django.conf.urls import url
 
 urlpatterns = patterns('bicycle.searchextensions.views',
     url(r'^update-index/$', 'update_index'),
+    url(r'^suggest/$', 'suggest'),
 )
\ No newline at end of file
@@ -2,42 +2,121 @@
 
 import re
 
+from django.conf import settings
+from haystack.query import SQ
 from haystack.query import SearchQuerySet
 from haystack.query import EmptySearchQuerySet
 
+from cache import LRUCache
+from cache import get_generation
+from cache import normalize_query
+
 
 quotes_re = re.compile(r'([\'"].*?[\'"])', re.S)
 
 
-def make_search_queryset(query_string, queryset_class=SearchQuerySet, empty_queryset_class=EmptySearchQuerySet):
+def split_query(query_string):
+    ''' Quoted phrases and separate words of the query string '''
+
+    query_parts = []
+    query_quotes = filter(None, [qp.strip() for qp in quotes_re.split(query_string)])
+
+    for qp in query_quotes:
+        if qp[0] in '\'"' and len(qp) > 1 and qp[-1] == qp[0]:
+            phrase = u' '.join(qp[1:-1].split())
+            if phrase:
+                query_parts.append(phrase)
+        else:
+            query_parts += qp.split()
+
+    return query_parts
+
+
+class QueryPlanner(object):
+
+    ''' Query parts and their spelling suggestions
+        ------------------------------------------
+
+    Suggestions of all words are asked from the backend by a single
+    spelling_suggestion() call, which returns them space separated in
+    the order of words (the Xapian backend does). Plans are kept in LRU
+    cache by the normalized query and the index generation, so a repeated
+    query costs no backend calls before the search itself.
+    '''
+
+    def __init__(self, maxsize=None):
+        self.cache = LRUCache(maxsize or getattr(settings, 'SEARCH_PLAN_CACHE_SIZE', 1000))
+
+    def plan(self, query_string, queryset_class=SearchQuerySet):
+        ''' Tuple of (part, suggestion or None) of the query string '''
+
+        key = (get_generation(), queryset_class, normalize_query(query_string))
+        plan = self.cache.get(key)
+
+        if plan is None:
+            query_parts = split_query(query_string)
+            plan = tuple(zip(query_parts, self.suggest(query_parts, queryset_class)))
+            self.cache.set(key, plan)
+
+        return plan
+
+    def suggest(self, query_parts, queryset_class=SearchQuerySet):
+        ''' Suggestion of every part, None if there is no better spelling '''
+
+        words = [part.split() for part in query_parts]
+        flat = [w for part in words for w in part]
+
+        if not flat:
+            return []
+
+        queryset = queryset_class()
+        # the suggestion runs the query, it is limited to a single hit
+        queryset.query.set_limits(0, 1)
+        suggestion = queryset.spelling_suggestion(u' '.join(flat)) or u''
+        suggested = suggestion.split(u' ')
+
+        if len(suggested) != len(flat):
+            # the backend does not suggest word by word
+            return [None] * len(query_parts)
+
+        suggestions = []
+        offset = 0
+
+        for part, part_words in zip(query_parts, words):
+            part_suggested = suggested[offset:offset + len(part_words)]
+            offset += len(part_words)
+            fixed = u' '.join(s or w for w, s in zip(part_words, part_suggested))
+            suggestions.append(fixed.lower() != part.lower() and fixed or None)
+
+        return suggestions
+
+    def build(self, plan, queryset_class=SearchQuerySet):
+        ''' SearchQuerySet of the plan, every part or its suggestion must match '''
+
+        sq = None
+
+        for part, suggestion in plan:
+            part_sq = SQ(content__startswith=part) | SQ(content=part)
+
+            if suggestion:
+                part_sq = part_sq | SQ(content__startswith=suggestion) | SQ(content=suggestion)
+
+            sq = part_sq if sq is None else sq & part_sq
+
+        return queryset_class().filter(sq)
+
+
+planner = QueryPlanner()
+
+
+def make_search_queryset(query_string, queryset_class=SearchQuerySet,
+                         empty_queryset_class=EmptySearchQuerySet):
     '''
     .. sectionauthor:: Василий Шередеко (piphon@gmail.com)
     '''
-    query_string = query_string.strip()
-    if query_string:
-        # Разбиваем на группы для поиска
-        query_parts = []
-        query_quotes = quotes_re.split(query_string)
-        query_quotes = filter(None, [qp.strip() for qp in query_quotes])
-        for qp in query_quotes:
-            if qp[0] == '"' or qp[0] == "\"":
-                query_parts.append(qp[1:-1])
-            else:
-                query_spaces = filter(None, [qp.strip() for qp in qp.split(' ')])
-                for qs in query_spaces:
-                    query_parts.append(qs)
-
-    # Включаем эти группы в поиск
-    queryset = queryset_class()
-    for qp in query_parts:
-        queryset_part = queryset_class().filter_or(content__startswith=qp).filter_or(content=qp)
-
-        suggestion = SearchQuerySet().filter(content__startswith=qp).spelling_suggestion()
-        if suggestion:
-            queryset_part = queryset_part.filter_or(
-                content__startswith=suggestion).filter_or(content=suggestion)
-        queryset &= queryset_part
-        return queryset
-    else:
-        queryset = empty_queryset_class()
-    return queryset
+    plan = planner.plan(query_string.strip(), queryset_class)
+
+    if not plan:
+        return empty_queryset_class()
+
+    return planner.build(plan, queryset_class)
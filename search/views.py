@@ -1,21 +1,30 @@
 # coding: UTF-8
 
+import json
+
 from django.shortcuts import redirect
 from django.views.generic import View
 from django.views.generic import ListView
 from django.core.context_processors import csrf
 from haystack.query import SearchQuerySet
 from haystack.query import EmptySearchQuerySet
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+from bicycle.rest.serializers import load_search_objects
+from bicycle.rest.serializers import resource_querysets
 from bicycle.rest.views import JsonResponseMixin
-import django_rq
 
+from cache import CachedSearchQuerySet
+from indexing import schedule_rebuild
+from suggest import LIMIT as SUGGEST_LIMIT
+from suggest import suggest as suggest_terms
 from utilites import make_search_queryset
 from forms import SearchForm
 
 
 def update_index(request):
-    func = 'bicycle.searchextensions.jobs.update_index'
-    django_rq.enqueue(func)
+    # a rebuild is not enqueued again, while it is queued or running
+    schedule_rebuild()
     try:
         return redirect(request.META['HTTP_REFERER'])
     except KeyError:
@@ -35,8 +44,9 @@ class SearchViewBase(ListView):
         form = self.search_form(self.request.GET)
         if form.is_valid():
             self.query = form.cleaned_data['q']
-            return make_queryset(self.query, queryset_class=self.queryset_class,
-                                 empty_queryset_class=self.empty_queryset_class)
+            qs = make_search_queryset(self.query, queryset_class=self.queryset_class,
+                                      empty_queryset_class=self.empty_queryset_class)
+            return CachedSearchQuerySet(qs, self.query)
         else:
             return self.empty_queryset_class()
 
@@ -44,41 +54,104 @@ class SearchViewBase(ListView):
         context = super(SearchViewBase, self).get_context_data(*args, **kwargs)
         context.update({
             'query': self.query,
-            'search_query': query,
+            'search_query': self.query,
             'result_objects': context['object_list'],
         })
         return context
 
 
+class SearchPaginator(Paginator):
+    ''' Paginator which slices the hits before the count
+        ------------------------------------------------
+
+    The count of CachedSearchQuerySet comes from the backend with the
+    slice, so a page costs a single search request.
+    '''
+
+    def page(self):
+        limit = self.get_limit()
+        offset = self.get_offset()
+        objects = self.get_slice(limit, offset)
+        count = self.get_count()
+        meta = {
+            'offset': offset,
+            'limit': limit,
+            'total_count': count,
+        }
+
+        if limit:
+            meta['previous'] = self.get_previous(limit, offset)
+            meta['next'] = self.get_next(limit, offset, count)
+
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
+
+
 class RestSearchViewBase(JsonResponseMixin, View):
     queryset_class = SearchQuerySet
     empty_queryset_class = EmptySearchQuerySet
     search_form = SearchForm
+    paginator_class = SearchPaginator
     query = None
     resource = None
 
-    def _get_bundle_list(self):
+    def _get_search_results(self):
         form = self.search_form(self.request.GET)
         if form.is_valid():
             self.query = form.cleaned_data['q']
             qs = make_search_queryset(self.query, queryset_class=self.queryset_class,
                                       empty_queryset_class=self.empty_queryset_class)
-            bundles = []
-            res = self.resource()
-            for obj in qs:
-                bundle = res.build_bundle(obj=obj.object, request=self.request)
-                bundles.append(res.full_dehydrate(bundle, for_list=True))
-            return bundles
+            return CachedSearchQuerySet(qs, self.query)
         else:
             return []
 
+    def _get_bundle_list(self, results):
+        # only hits of the page are loaded and dehydrated
+        bundles = []
+        res = self.resource()
+        for obj in load_search_objects(results, resource_querysets(res)):
+            bundle = res.build_bundle(obj=obj, request=self.request)
+            bundles.append(res.full_dehydrate(bundle, for_list=True))
+        return bundles
+
     def get(self, request, *args, **kwargs):
         res = self.resource()
-        bs = self._get_bundle_list()
+        paginator = self.paginator_class(
+            request.GET, self._get_search_results(), resource_uri=request.path,
+            limit=res._meta.limit, max_limit=res._meta.max_limit)
+        try:
+            page = paginator.page()
+        except BadRequest, e:
+            return self.response(None, False, json.dumps({'error': unicode(e)}), status=400)
         data = {}
-        data['meta'] = {}
-        data['meta']['total_count'] = len(bs)
+        data['meta'] = page['meta']
         data['meta']['csrf_header_name'] = 'X-CSRFToken'
         data['meta']['csrf_header_value'] = csrf(request)['csrf_token']
-        data['objects'] = bs
+        data['objects'] = self._get_bundle_list(page['objects'])
         return self.response(res.serialize(None, data, "application/json"), True)
+
+
+class SuggestView(JsonResponseMixin, View):
+    ''' Completions of the search box query from the suggest file
+        ---------------------------------------------------------
+
+    Nothing is asked from Xapian, terms are in memory of the process.
+
+    GET params: q, limit (up to max_limit).
+    '''
+
+    max_limit = 20
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get('limit', SUGGEST_LIMIT)), self.max_limit)
+        except ValueError:
+            return self.response(None, False, json.dumps({'error': 'limit must be an integer'}),
+                                 status=400)
+        query = request.GET.get('q', u'')[:SearchForm.base_fields['q'].max_length]
+        return self.response({'query': query, 'suggestions': suggest_terms(query, max(limit, 0))})
+
+
+suggest = SuggestView.as_view()
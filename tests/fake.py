@@ -0,0 +1,935 @@
+# -*- coding: utf-8 -*-
+
+import BaseHTTPServer
+import SocketServer
+import datetime
+import email
+import hashlib
+import itertools
+import json
+import random
+import re
+import socket
+import threading
+import time
+import traceback
+import urlparse
+import uuid
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+from django.test.utils import override_settings
+from oauth2client.client import AccessTokenCredentials
+
+from bicycle.gdrive import GDrive
+from bicycle.gdrive.atom import ATOM_ENTRY
+from bicycle.gdrive.atom import ATOM_LINK
+from bicycle.gdrive.atom import ATOM_NS
+from bicycle.gdrive.atom import ATOM_TITLE
+from bicycle.gdrive.atom import BATCH_ID
+from bicycle.gdrive.atom import BATCH_NS
+from bicycle.gdrive.atom import GS_CELL
+from bicycle.gdrive.atom import GS_COL_COUNT
+from bicycle.gdrive.atom import GS_NS
+from bicycle.gdrive.atom import GS_ROW_COUNT
+
+
+FOLDER = u'application/vnd.google-apps.folder'
+DOCUMENT = u'application/vnd.google-apps.document'
+SPREADSHEET = u'application/vnd.google-apps.spreadsheet'
+
+EXPORT_FORMATS = {
+    DOCUMENT: ['text/plain', 'application/pdf'],
+    SPREADSHEET: ['text/csv', 'application/pdf'],
+}
+
+# statuses and reasons of injected errors, both are retryable
+INJECTED_ERRORS = [
+    (503, 'backendError', 'Backend Error'),
+    (403, 'userRateLimitExceeded', 'User Rate Limit Exceeded'),
+]
+
+BATCH_LIMIT = 100
+
+q_clause_re = re.compile(
+    r"^\s*(?:'(?P<parent>[^']*)'\s+in\s+parents|"
+    r"(?P<field>title|mimeType)\s*=\s*'(?P<value>[^']*)'|"
+    r"trashed\s*=\s*(?P<trashed>true|false))\s*$")
+range_re = re.compile(r'^bytes=(\d+)-(\d*)$')
+content_range_re = re.compile(r'^bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$')
+
+
+def error_body(status, reason, message):
+    ''' JSON error of Drive API, parsed by errors.HttpError '''
+
+    return json.dumps({'error': {
+        'errors': [{'domain': 'global', 'reason': reason, 'message': message}],
+        'code': status,
+        'message': message,
+    }})
+
+
+class FakeGoogle(object):
+
+    ''' Local fake of Drive API v2 and Spreadsheets feeds
+        -------------------------------------------------
+
+    In-memory server of the endpoints used by GFactory, GFileBase, GSheet
+    and GWorkSheet: discovery document, files, resumable uploads, batch,
+    changes, downloads, worksheets and cells feeds. It keeps ETags, edit
+    link versions and the change log like the real services, the fields
+    projection is ignored and full resources are returned.
+
+    Arguments:
+        latency: seconds added to every HTTP request.
+        error_rate: probability of 503 backendError or 403
+            userRateLimitExceeded of every API call (batch parts
+            included), the discovery document is never failed.
+        seed: seed of the error generator, for repeatable runs.
+
+    Both latency and error_rate can be changed while the server works,
+    as well as injected_errors: (status, reason, message) to choose from.
+
+    Usage:
+    ::
+        with FakeGoogle(latency=0.05, error_rate=0.01) as fake:
+            gdrive = fake.connect()
+    '''
+
+    routes = [
+        (('GET',), r'^/discovery/v1/apis/drive/v2/rest$', 'discovery'),
+        (('POST',), r'^/batch/drive/v2$', 'batch'),
+        (('GET',), r'^/drive/v2/files$', 'files_list'),
+        (('POST',), r'^/drive/v2/files$', 'files_insert'),
+        (('GET',), r'^/drive/v2/files/([^/]+)$', 'files_get'),
+        (('PUT', 'PATCH'), r'^/drive/v2/files/([^/]+)$', 'files_update'),
+        (('DELETE',), r'^/drive/v2/files/([^/]+)$', 'files_delete'),
+        (('POST', 'PUT'), r'^/upload/drive/v2/files(?:/([^/]+))?$', 'upload_start'),
+        (('PUT',), r'^/upload/session/([^/]+)$', 'upload_chunk'),
+        (('GET',), r'^/drive/v2/changes/startPageToken$', 'changes_token'),
+        (('GET',), r'^/drive/v2/changes$', 'changes_list'),
+        (('GET',), r'^/download/([^/]+)$', 'download'),
+        (('GET',), r'^/export/([^/]+)$', 'export'),
+        (('GET',), r'^/exported/([^/]+)$', 'exported'),
+        (('GET',), r'^/feeds/worksheets/([^/]+)/private/full$', 'worksheets_feed'),
+        (('POST',), r'^/feeds/worksheets/([^/]+)/private/full$', 'worksheets_insert'),
+        (('PUT',), r'^/feeds/worksheets/([^/]+)/private/full/([^/]+)/[^/]+$',
+         'worksheets_update'),
+        (('GET',), r'^/feeds/cells/([^/]+)/([^/]+)/private/full$', 'cells_feed'),
+        (('POST',), r'^/feeds/cells/([^/]+)/([^/]+)/private/full/batch$', 'cells_batch'),
+    ]
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, error_rate=0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.injected_errors = list(INJECTED_ERRORS)
+        self.random = random.Random(seed)
+        self.stats = {'connections': 0, 'requests': 0, 'calls': 0, 'errors': 0}
+        self.files = OrderedDict()
+        self.contents = {}
+        self.sheets = {}
+        self.changes = []
+        self.uploads = {}
+        self._counter = itertools.count(1)
+        self._last_stamp = None
+        self._lock = threading.RLock()
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self._thread = None
+        self.url = 'http://%s:%d' % self._server.server_address
+        self.root_id = self._insert({'title': u'My Drive', 'mimeType': FOLDER})['id']
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def discovery_uri(self):
+        return self.url + '/discovery/v1/apis/{api}/{apiVersion}/rest'
+
+    @property
+    def batch_uri(self):
+        return self.url + '/batch/drive/v2'
+
+    @property
+    def feeds_url(self):
+        return self.url + '/feeds'
+
+    def connect(self, user_key='fake'):
+        ''' GDrive of a fake user, which talks to this server '''
+
+        with override_settings(GDRIVE_DISCOVERY_URI=self.discovery_uri):
+            gdrive = GDrive(credentials=AccessTokenCredentials('fake-token', 'fake'),
+                            user_key=user_key)
+
+        gdrive.batch_uri = self.batch_uri
+        gdrive.feeds_url = self.feeds_url
+        return gdrive
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.close_connections()
+        self._server.server_close()
+        self._thread.join()
+
+    def handle(self, method, path, headers, body):
+        ''' Response (status, headers, content) of the HTTP request '''
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.stats['requests'] += 1
+
+        try:
+            return self.dispatch(method, path, headers, body)
+        except Exception:
+            return 500, {'content-type': 'text/plain'}, traceback.format_exc()
+
+    def dispatch(self, method, path, headers, body):
+        ''' Route the request (or a part of a batch) to the endpoint '''
+
+        parts = urlparse.urlsplit(path)
+        params = dict(urlparse.parse_qsl(parts.query, keep_blank_values=True))
+
+        for methods, pattern, name in self.routes:
+            match = re.match(pattern, parts.path)
+
+            if match is None or method not in methods:
+                continue
+
+            if name not in ('discovery', 'batch'):
+
+                if not headers.get('authorization', '').startswith('Bearer '):
+                    return self._error(401, 'authError', 'Invalid Credentials')
+
+                injected = self._inject()
+
+                if injected is not None:
+                    return injected
+
+            with self._lock:
+                return getattr(self, '_' + name)(params, headers, body, *match.groups())
+
+        return self._error(404, 'notFound', 'Not Found: %s %s' % (method, parts.path))
+
+    ###################
+    # Private methods #
+    ###################
+    def _inject(self):
+
+        with self._lock:
+            self.stats['calls'] += 1
+
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return self._error(*self.random.choice(self.injected_errors))
+
+        return None
+
+    def _error(self, status, reason, message):
+        return status, {'content-type': 'application/json'}, error_body(status, reason, message)
+
+    def _json(self, obj, status=200, headers=None):
+        response_headers = {'content-type': 'application/json; charset=UTF-8'}
+        response_headers.update(headers or {})
+        return status, response_headers, json.dumps(obj)
+
+    def _atom(self, xml, status=200, headers=None):
+        response_headers = {'content-type': 'application/atom+xml; charset=UTF-8'}
+        response_headers.update(headers or {})
+        return status, response_headers, xml.encode('utf-8')
+
+    def _next(self):
+        return next(self._counter)
+
+    def _stamp(self):
+        # strictly increasing, so updated-min never misses a change
+        now = datetime.datetime.utcnow()
+
+        if self._last_stamp is not None and now <= self._last_stamp:
+            now = self._last_stamp + datetime.timedelta(microseconds=1)
+
+        self._last_stamp = now
+        return now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    def _file(self, file_id):
+        return self.files.get(file_id == 'root' and self.root_id or file_id)
+
+    def _not_found(self, file_id):
+        return self._error(404, 'notFound', 'File not found: %s' % file_id)
+
+    def _touch(self, item):
+        item['etag'] = '"%d"' % self._next()
+        item['modifiedDate'] = self._stamp()
+        self.changes += [{'fileId': item['id'], 'deleted': False, 'file': dict(item)}]
+
+    def _insert(self, metadata, file_id=None):
+        file_id = file_id or uuid.uuid4().hex
+        item = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'title': metadata.get('title') or u'Untitled',
+            'mimeType': metadata.get('mimeType') or 'application/octet-stream',
+            'description': metadata.get('description'),
+            'parents': [],
+            'labels': {'trashed': False},
+            'createdDate': self._stamp(),
+        }
+        self._set_metadata(item, metadata)
+
+        if item['mimeType'] in EXPORT_FORMATS:
+            item['exportLinks'] = dict(
+                (mime, '%s/export/%s?mimeType=%s' % (self.url, file_id, mime))
+                for mime in EXPORT_FORMATS[item['mimeType']])
+
+        if item['mimeType'] == SPREADSHEET:
+            self.sheets[file_id] = {'version': self._next(), 'worksheets': OrderedDict()}
+            self._add_worksheet(file_id, u'Sheet1', 1000, 26)
+
+        self.files[file_id] = item
+        self._touch(item)
+        return item
+
+    def _set_metadata(self, item, metadata):
+
+        for key in ('title', 'mimeType', 'description'):
+
+            if metadata.get(key) is not None:
+                item[key] = metadata[key]
+
+        if metadata.get('parents') is not None:
+            item['parents'] = [
+                {'kind': 'drive#parentReference',
+                 'id': isinstance(p, dict) and p['id'] or p}
+                for p in metadata['parents']]
+
+        root_id = getattr(self, 'root_id', None)
+
+        if not item['parents'] and root_id is not None and item['id'] != root_id:
+            item['parents'] = [{'kind': 'drive#parentReference', 'id': root_id}]
+
+    def _set_content(self, item, content):
+        self.contents[item['id']] = content
+        item['fileSize'] = str(len(content))
+        item['md5Checksum'] = hashlib.md5(content).hexdigest()
+        item['downloadUrl'] = '%s/download/%s' % (self.url, item['id'])
+
+    def _match(self, item, q):
+
+        for clause in filter(None, re.split(r'\s+and\s+', q)):
+            match = q_clause_re.match(clause)
+
+            if match is None:
+                continue
+
+            if match.group('parent') is not None:
+
+                if match.group('parent') not in [p['id'] for p in item['parents']]:
+                    return False
+
+            elif match.group('field') is not None:
+
+                if item.get(match.group('field')) != match.group('value'):
+                    return False
+
+            elif (match.group('trashed') == 'true') != item['labels']['trashed']:
+                return False
+
+        return True
+
+    def _discovery(self, params, headers, body):
+        return self._json(discovery_document(self.url))
+
+    def _batch(self, params, headers, body):
+        message = email.message_from_string(
+            'content-type: %s\r\n\r\n%s' % (headers.get('content-type', ''), body))
+
+        if not message.is_multipart():
+            return self._error(400, 'badRequest', 'Batch body is not multipart/mixed')
+
+        parts = message.get_payload()
+
+        if len(parts) > BATCH_LIMIT:
+            return self._error(400, 'badRequest',
+                               'A batch is limited to %d calls' % BATCH_LIMIT)
+
+        boundary = 'batch_%s' % uuid.uuid4().hex
+        chunks = []
+
+        for part in parts:
+            request_line, rest = part.get_payload().split('\n', 1)
+            (method, path, version) = request_line.strip().split(' ', 2)
+            request = email.message_from_string(rest)
+            request_headers = dict((k.lower(), v) for k, v in request.items())
+            (status, response_headers, content) = self.dispatch(
+                method, path, request_headers, request.get_payload())
+            lines = ['HTTP/1.1 %d %s' % (status, BaseHTTPServer.BaseHTTPRequestHandler.
+                                         responses.get(status, ('',))[0])]
+            lines += ['%s: %s' % item for item in response_headers.items()]
+            chunks += ['--%s\r\nContent-Type: application/http\r\nContent-ID: <response-%s>'
+                       '\r\n\r\n%s\r\n\r\n%s\r\n' % (
+                           boundary, part['Content-ID'][1:-1], '\r\n'.join(lines), content)]
+
+        chunks += ['--%s--' % boundary]
+        return 200, {'content-type': 'multipart/mixed; boundary=%s' % boundary}, ''.join(chunks)
+
+    def _files_list(self, params, headers, body):
+        items = [item for item in self.files.values() if item['id'] != self.root_id and
+                 self._match(item, params.get('q', ''))]
+        start = int(params.get('pageToken') or 0)
+        end = start + int(params.get('maxResults') or 100)
+        result = {'kind': 'drive#fileList', 'items': items[start:end]}
+
+        if end < len(items):
+            result['nextPageToken'] = str(end)
+
+        return self._json(result)
+
+    def _files_insert(self, params, headers, body):
+        return self._json(self._insert(json.loads(body or '{}')))
+
+    def _files_get(self, params, headers, body, file_id):
+        item = self._file(file_id)
+
+        if item is None:
+            return self._not_found(file_id)
+
+        if headers.get('if-none-match') == item['etag']:
+            return 304, {'etag': item['etag']}, ''
+
+        return self._json(item, headers={'etag': item['etag']})
+
+    def _files_update(self, params, headers, body, file_id):
+        item = self._file(file_id)
+
+        if item is None:
+            return self._not_found(file_id)
+
+        self._set_metadata(item, json.loads(body or '{}'))
+        self._touch(item)
+        return self._json(item)
+
+    def _files_delete(self, params, headers, body, file_id):
+        item = self._file(file_id)
+
+        if item is None:
+            return self._not_found(file_id)
+
+        del self.files[item['id']]
+        self.contents.pop(item['id'], None)
+        self.sheets.pop(item['id'], None)
+        self.changes += [{'fileId': item['id'], 'deleted': True}]
+        return 204, {}, ''
+
+    def _upload_start(self, params, headers, body, file_id=None):
+
+        if params.get('uploadType') != 'resumable':
+            return self._error(400, 'badRequest', 'Only resumable uploads are supported')
+
+        if file_id is not None and self._file(file_id) is None:
+            return self._not_found(file_id)
+
+        session_id = uuid.uuid4().hex
+        metadata = json.loads(body or '{}')
+        metadata.setdefault('mimeType', headers.get('x-upload-content-type'))
+        self.uploads[session_id] = {
+            'file_id': file_id,
+            'metadata': metadata,
+            'chunks': [],
+            'received': 0,
+        }
+        return 200, {'location': '%s/upload/session/%s' % (self.url, session_id)}, ''
+
+    def _upload_chunk(self, params, headers, body, session_id):
+        upload = self.uploads.get(session_id)
+
+        if upload is None:
+            return self._error(404, 'notFound', 'Upload session is expired')
+
+        match = content_range_re.match(headers.get('content-range', ''))
+
+        if match is None:
+            return self._error(400, 'badRequest', 'Wrong Content-Range')
+
+        (first, last, total) = match.groups()
+
+        if first is not None and int(first) == upload['received']:
+            upload['chunks'] += [body]
+            upload['received'] += len(body)
+
+        if total != '*' and upload['received'] >= int(total):
+            del self.uploads[session_id]
+            content = ''.join(upload['chunks'])
+
+            if upload['file_id'] is None:
+                item = self._insert(upload['metadata'])
+            else:
+                item = self._file(upload['file_id'])
+                self._set_metadata(item, upload['metadata'])
+
+            self._set_content(item, content)
+            self._touch(item)
+            return self._json(item)
+
+        # the client continues from the last received byte
+        response_headers = {}
+
+        if upload['received']:
+            response_headers['range'] = 'bytes=0-%d' % (upload['received'] - 1)
+
+        return 308, response_headers, ''
+
+    def _changes_token(self, params, headers, body):
+        return self._json({'kind': 'drive#startPageToken',
+                           'startPageToken': str(len(self.changes) + 1)})
+
+    def _changes_list(self, params, headers, body):
+        start = int(params.get('pageToken') or 1) - 1
+        end = start + int(params.get('maxResults') or 100)
+        items = []
+
+        for i, change in enumerate(self.changes[start:end], start + 1):
+
+            if change['deleted'] and params.get('includeDeleted') == 'false':
+                continue
+
+            items += [dict(change, kind='drive#change', id=str(i))]
+
+        result = {'kind': 'drive#changeList', 'items': items}
+
+        if end < len(self.changes):
+            result['nextPageToken'] = str(end + 1)
+        else:
+            result['newStartPageToken'] = str(len(self.changes) + 1)
+
+        return self._json(result)
+
+    def _download(self, params, headers, body, file_id):
+        content = self.contents.get(file_id)
+
+        if content is None:
+            return self._not_found(file_id)
+
+        match = range_re.match(headers.get('range', ''))
+
+        if match is None:
+            return 200, {'content-type': 'application/octet-stream'}, content
+
+        first = int(match.group(1))
+        last = min(int(match.group(2) or len(content) - 1), len(content) - 1)
+
+        if first >= len(content):
+            return 416, {'content-range': 'bytes */%d' % len(content)}, ''
+
+        return 206, {
+            'content-type': 'application/octet-stream',
+            'content-range': 'bytes %d-%d/%d' % (first, last, len(content)),
+        }, content[first:last + 1]
+
+    def _export(self, params, headers, body, file_id):
+        item = self._file(file_id)
+
+        if item is None:
+            return self._not_found(file_id)
+
+        mime_type = params.get('mimeType')
+
+        if mime_type not in EXPORT_FORMATS.get(item['mimeType'], []):
+            return self._error(400, 'badRequest', 'Export to %s is not supported' % mime_type)
+
+        # export links redirect to the content, like the real ones do
+        return 302, {'location': '/exported/%s?mimeType=%s' % (file_id, mime_type)}, ''
+
+    def _exported(self, params, headers, body, file_id):
+        item = self._file(file_id)
+        mime_type = params.get('mimeType')
+
+        if item is None or mime_type not in EXPORT_FORMATS.get(item['mimeType'], []):
+            return self._not_found(file_id)
+
+        if mime_type == 'text/csv':
+            worksheet = self.sheets[file_id]['worksheets'].values()[0]
+            cells = worksheet['cells']
+            rows = max([r for r, c in cells] or [0])
+            cols = max([c for r, c in cells] or [0])
+            content = u'\r\n'.join(
+                u','.join(cells.get((r, c), {}).get('value', u'') for c in range(1, cols + 1))
+                for r in range(1, rows + 1))
+        else:
+            content = item['title']
+
+        return 200, {'content-type': mime_type}, content.encode('utf-8')
+
+    ###############
+    # Spreadsheet #
+    ###############
+    def _sheet(self, key):
+        return self.sheets.get(key)
+
+    def _add_worksheet(self, key, title, rows, cols):
+        worksheet_id = 'od%d' % (len(self.sheets[key]['worksheets']) + 6)
+
+        while worksheet_id in self.sheets[key]['worksheets']:
+            worksheet_id += 'x'
+
+        self.sheets[key]['worksheets'][worksheet_id] = {
+            'id': worksheet_id,
+            'title': title,
+            'rows': rows,
+            'cols': cols,
+            'version': self._next(),
+            'updated': self._stamp(),
+            'cells': {},
+        }
+        self.sheets[key]['version'] = self._next()
+        return self.sheets[key]['worksheets'][worksheet_id]
+
+    def _worksheet_entry(self, key, worksheet):
+        url = '%s/feeds/worksheets/%s/private/full/%s' % (self.url, key, worksheet['id'])
+        return (u'<entry><id>%s</id><updated>%s</updated><title type="text">%s</title>'
+                u'<link rel="edit" type="application/atom+xml" href="%s/%d"/>'
+                u'<gs:rowCount>%d</gs:rowCount><gs:colCount>%d</gs:colCount></entry>') % (
+            url, worksheet['updated'], escape(worksheet['title']), url,
+            worksheet['version'], worksheet['rows'], worksheet['cols'])
+
+    def _feed(self, feed_id, entries):
+        return (u'<?xml version="1.0" encoding="UTF-8"?>'
+                u'<feed xmlns="%s" xmlns:batch="%s" xmlns:gs="%s">'
+                u'<id>%s</id><updated>%s</updated>%s</feed>') % (
+            ATOM_NS, BATCH_NS, GS_NS, feed_id, self._stamp(), u''.join(entries))
+
+    def _parse_worksheet(self, body):
+
+        try:
+            entry = ET.fromstring(body)
+            return (entry.findtext(ATOM_TITLE), int(entry.findtext(GS_ROW_COUNT)),
+                    int(entry.findtext(GS_COL_COUNT)))
+        except (ET.ParseError, TypeError, ValueError):
+            return None
+
+    def _same_title(self, key, title, worksheet_id=None):
+        return any(w['title'] == title and w['id'] != worksheet_id
+                   for w in self.sheets[key]['worksheets'].values())
+
+    def _worksheets_feed(self, params, headers, body, key):
+        sheet = self._sheet(key)
+
+        if sheet is None:
+            return 404, {'content-type': 'text/plain'}, 'Spreadsheet not found'
+
+        etag = 'W/"%d"' % sheet['version']
+
+        if headers.get('if-none-match') == etag:
+            return 304, {'etag': etag}, ''
+
+        feed_id = '%s/feeds/worksheets/%s/private/full' % (self.url, key)
+        entries = [self._worksheet_entry(key, w) for w in sheet['worksheets'].values()]
+        return self._atom(self._feed(feed_id, entries), headers={'etag': etag})
+
+    def _worksheets_insert(self, params, headers, body, key):
+
+        if self._sheet(key) is None:
+            return 404, {'content-type': 'text/plain'}, 'Spreadsheet not found'
+
+        parsed = self._parse_worksheet(body)
+
+        if parsed is None:
+            return 400, {'content-type': 'text/plain'}, 'Wrong worksheet entry'
+
+        if self._same_title(key, parsed[0]):
+            return 400, {'content-type': 'text/plain'}, (
+                'A sheet with the name "%s" already exists.' % parsed[0].encode('utf-8'))
+
+        worksheet = self._add_worksheet(key, *parsed)
+        return self._atom(u'<?xml version="1.0" encoding="UTF-8"?>%s' % self._worksheet_entry(
+            key, worksheet).replace(u'<entry>', u'<entry xmlns="%s" xmlns:gs="%s">' % (
+                ATOM_NS, GS_NS), 1), status=201)
+
+    def _worksheets_update(self, params, headers, body, key, worksheet_id):
+        sheet = self._sheet(key)
+
+        if sheet is None or worksheet_id not in sheet['worksheets']:
+            return 404, {'content-type': 'text/plain'}, 'Worksheet not found'
+
+        parsed = self._parse_worksheet(body)
+
+        if parsed is None:
+            return 400, {'content-type': 'text/plain'}, 'Wrong worksheet entry'
+
+        if self._same_title(key, parsed[0], worksheet_id):
+            return 400, {'content-type': 'text/plain'}, (
+                'A sheet with the name "%s" already exists.' % parsed[0].encode('utf-8'))
+
+        worksheet = sheet['worksheets'][worksheet_id]
+        (worksheet['title'], worksheet['rows'], worksheet['cols']) = parsed
+        worksheet['version'] = self._next()
+        worksheet['updated'] = self._stamp()
+        sheet['version'] = self._next()
+        return self._atom(u'<?xml version="1.0" encoding="UTF-8"?>%s' % self._worksheet_entry(
+            key, worksheet).replace(u'<entry>', u'<entry xmlns="%s" xmlns:gs="%s">' % (
+                ATOM_NS, GS_NS), 1))
+
+    def _cell_entry(self, url, row, col, cell, batch=u''):
+        key = u'R%dC%d' % (row, col)
+        return (u'<entry>%s<id>%s/%s</id><updated>%s</updated><title>%s</title>'
+                u'<link rel="edit" type="application/atom+xml" href="%s/%s/%s"/>'
+                u'<gs:cell row="%d" col="%d" inputValue=%s>%s</gs:cell></entry>') % (
+            batch, url, key, cell.get('updated', u''), key, url, key,
+            cell.get('version', 0), row, col, quoteattr(cell.get('value', u'')),
+            escape(cell.get('value', u'')))
+
+    def _cells_feed(self, params, headers, body, key, worksheet_id):
+        sheet = self._sheet(key)
+
+        if sheet is None or worksheet_id not in sheet['worksheets']:
+            return 404, {'content-type': 'text/plain'}, 'Worksheet not found'
+
+        worksheet = sheet['worksheets'][worksheet_id]
+        min_row = max(int(params.get('min-row') or 1), 1)
+        max_row = min(int(params.get('max-row') or worksheet['rows']), worksheet['rows'])
+        min_col = max(int(params.get('min-col') or 1), 1)
+        max_col = min(int(params.get('max-col') or worksheet['cols']), worksheet['cols'])
+        updated_min = params.get('updated-min')
+
+        if params.get('return-empty') == 'true':
+            coords = [(r, c) for r in range(min_row, max_row + 1)
+                      for c in range(min_col, max_col + 1)]
+        else:
+            coords = sorted((r, c) for r, c in worksheet['cells']
+                            if min_row <= r <= max_row and min_col <= c <= max_col)
+
+        url = '%s/feeds/cells/%s/%s/private/full' % (self.url, key, worksheet_id)
+        entries = []
+
+        for row, col in coords:
+            cell = worksheet['cells'].get((row, col), {})
+
+            if updated_min is not None and cell.get('updated', u'') < updated_min:
+                continue
+
+            entries += [self._cell_entry(url, row, col, cell)]
+
+        return self._atom(self._feed(url, entries))
+
+    def _cells_batch(self, params, headers, body, key, worksheet_id):
+        sheet = self._sheet(key)
+
+        if sheet is None or worksheet_id not in sheet['worksheets']:
+            return 404, {'content-type': 'text/plain'}, 'Worksheet not found'
+
+        try:
+            feed = ET.fromstring(body)
+        except ET.ParseError:
+            return 400, {'content-type': 'text/plain'}, 'Wrong batch feed'
+
+        worksheet = sheet['worksheets'][worksheet_id]
+        url = '%s/feeds/cells/%s/%s/private/full' % (self.url, key, worksheet_id)
+        entries = []
+
+        for entry in feed.findall(ATOM_ENTRY):
+            batch_id = entry.findtext(BATCH_ID)
+            cell = entry.find(GS_CELL)
+            row, col = int(cell.get('row')), int(cell.get('col'))
+            current = worksheet['cells'].get((row, col), {})
+            href = ''
+
+            for link in entry.findall(ATOM_LINK):
+
+                if link.get('rel') == 'edit':
+                    href = link.get('href') or ''
+
+            if row > worksheet['rows'] or col > worksheet['cols']:
+                (code, reason) = (400, 'Bad Request')
+            elif not href or href.split('/')[-1] != str(current.get('version', 0)):
+                # the edit link of another version of the cell
+                (code, reason) = (409, 'Conflict')
+            else:
+                (code, reason) = (200, 'Success')
+                current = {
+                    'value': cell.get('inputValue') or u'',
+                    'version': self._next(),
+                    'updated': self._stamp(),
+                }
+                worksheet['cells'][(row, col)] = current
+
+            batch = (u'<batch:id>%s</batch:id><batch:operation type="update"/>'
+                     u'<batch:status code="%d" reason="%s"/>') % (
+                escape(batch_id or u''), code, reason)
+            entries += [self._cell_entry(url, row, col, current, batch)]
+
+        return self._atom(self._feed(url + '/batch', entries))
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        BaseHTTPServer.HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+
+    def process_request(self, request, client_address):
+        self.connections.add(request)
+        self.fake.stats['connections'] += 1
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        self.connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        # keep-alive handlers wait for the next request of pooled clients
+        for request in list(self.connections):
+
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, like the real services
+    protocol_version = 'HTTP/1.1'
+
+    def handle_request(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        body = length and self.rfile.read(length) or ''
+        headers = dict(self.headers.items())
+        (status, response_headers, content) = self.server.fake.handle(
+            self.command, self.path, headers, body)
+        self.send_response(status)
+
+        for name, value in response_headers.items():
+            self.send_header(name, value)
+
+        self.send_header('content-length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+def discovery_document(url):
+    ''' Minimal Drive API v2 discovery document of the fake server '''
+
+    def query(type='string'):
+        return {'type': type, 'location': 'query'}
+
+    file_id = {'type': 'string', 'location': 'path', 'required': True}
+    media = {
+        'accept': ['*/*'],
+        'maxSize': '5120GB',
+        'protocols': {
+            'simple': {'multipart': True, 'path': '/upload/drive/v2/files'},
+            'resumable': {'multipart': True, 'path': '/resumable/upload/drive/v2/files'},
+        },
+    }
+
+    def method(name, path, http_method, parameters=None, request=None, response=None,
+               upload=False):
+        description = {
+            'id': 'drive.%s' % name,
+            'path': path,
+            'httpMethod': http_method,
+            'parameters': parameters or {},
+        }
+
+        if 'fileId' in description['parameters']:
+            description['parameterOrder'] = ['fileId']
+
+        if request is not None:
+            description['request'] = {'$ref': request}
+
+        if response is not None:
+            description['response'] = {'$ref': response}
+
+        if upload:
+            description['supportsMediaUpload'] = True
+            description['mediaUpload'] = media
+
+        return description
+
+    return {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': 'drive:v2',
+        'name': 'drive',
+        'version': 'v2',
+        'protocol': 'rest',
+        'rootUrl': url + '/',
+        'servicePath': 'drive/v2/',
+        'baseUrl': url + '/drive/v2/',
+        'batchPath': 'batch/drive/v2',
+        'parameters': {
+            'alt': {'type': 'string', 'default': 'json', 'enum': ['json'],
+                    'location': 'query'},
+            'fields': query(),
+            'quotaUser': query(),
+        },
+        'schemas': {
+            'File': {'id': 'File', 'type': 'object'},
+            'FileList': {'id': 'FileList', 'type': 'object'},
+            'ChangeList': {'id': 'ChangeList', 'type': 'object'},
+            'StartPageToken': {'id': 'StartPageToken', 'type': 'object'},
+        },
+        'resources': {
+            'files': {'methods': {
+                'list': method('files.list', 'files', 'GET', {
+                    'q': query(),
+                    'maxResults': query('integer'),
+                    'pageToken': query(),
+                    'orderBy': query(),
+                    'corpus': query(),
+                    'spaces': query(),
+                }, response='FileList'),
+                'get': method('files.get', 'files/{fileId}', 'GET', {
+                    'fileId': file_id,
+                }, response='File'),
+                'insert': method('files.insert', 'files', 'POST', {
+                    'convert': query('boolean'),
+                }, 'File', 'File', upload=True),
+                'update': method('files.update', 'files/{fileId}', 'PUT', {
+                    'fileId': file_id,
+                    'convert': query('boolean'),
+                    'newRevision': query('boolean'),
+                }, 'File', 'File', upload=True),
+                'patch': method('files.patch', 'files/{fileId}', 'PATCH', {
+                    'fileId': file_id,
+                    'convert': query('boolean'),
+                    'newRevision': query('boolean'),
+                }, 'File', 'File'),
+                'delete': method('files.delete', 'files/{fileId}', 'DELETE', {
+                    'fileId': file_id,
+                }),
+            }},
+            'changes': {'methods': {
+                'getStartPageToken': method('changes.getStartPageToken',
+                                            'changes/startPageToken', 'GET',
+                                            response='StartPageToken'),
+                'list': method('changes.list', 'changes', 'GET', {
+                    'pageToken': query(),
+                    'maxResults': query('integer'),
+                    'includeDeleted': query('boolean'),
+                    'includeSubscribed': query('boolean'),
+                    'spaces': query(),
+                }, response='ChangeList'),
+            }},
+        },
+    }
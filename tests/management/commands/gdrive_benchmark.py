@@ -0,0 +1,203 @@
+# coding: UTF-8
+
+import os
+import shutil
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils.encoding import force_str
+from django.utils.termcolors import make_style
+
+from bicycle.gdrive import GFactory
+from bicycle.gdrive import GFile
+from bicycle.gdrive import GFolder
+from bicycle.gdrive import GSheet
+from bicycle.gdrive import GWorkSheet
+from bicycle.gdrive import upload_files
+from bicycle.tests.fake import FakeGoogle
+
+
+success = make_style(fg='green')
+error = make_style(fg='red')
+notice = make_style(fg='yellow')
+
+
+def measure(name, count, unit, func):
+    ''' Run func once, print and return count / seconds '''
+
+    started = time.time()
+
+    try:
+        func()
+    except Exception, e:
+        print u'%-28s %s' % (name, error(u'%s: %s' % (e.__class__.__name__, e)))
+        return None
+
+    elapsed = time.time() - started
+    rate = count / elapsed
+    print u'%-28s %10.1f %s/s  (%g in %.2fs)' % (name, rate, unit, count, elapsed)
+    return rate
+
+
+def create_files(gdrive, folder, count):
+    results = []
+
+    with gdrive.batch():
+        for i in range(count):
+            f = GFile(gdrive, {})
+            f.title = u'benchmark-%d.txt' % i
+            f.mime_type = u'text/plain'
+            f.parents = [{'id': folder.get_id()}]
+            results += [f.save()]
+
+    return [r.result() for r in results]
+
+
+def list_files(gdrive, folder, count, **kwargs):
+    q = u"'%s' in parents" % folder.get_id()
+    items = list(GFactory.filter(gdrive, q=q, **kwargs))
+    assert len(items) == count, 'listed %d of %d files' % (len(items), count)
+
+
+def save_files(gdrive, files):
+
+    with gdrive.batch():
+        results = []
+
+        for f in files:
+            f.description = u'updated at %s' % time.time()
+            results += [f.save()]
+
+    for r in results:
+        r.result()
+
+
+def upload(gdrive, folder, paths, workers):
+    files = []
+
+    for path in paths:
+        f = GFile(gdrive, {})
+        f.title = os.path.basename(path)
+        f.mime_type = f.file_mime_type = u'application/octet-stream'
+        f.parents = [{'id': folder.get_id()}]
+        f.filename = path
+        f.chunksize = 256 * 1024
+        files += [f]
+
+    for r in upload_files(files, workers=workers):
+        r.result()
+
+
+def write_cells(worksheet, rows, cols, batch_size, workers):
+    values = ([u'%d:%d' % (r, c) for c in range(cols)] for r in range(rows))
+    failed = [r for r in worksheet.bulk_update(values, batch_size=batch_size, workers=workers)
+              if not r.ok]
+    assert not failed, '%d cells are not written' % len(failed)
+
+
+class Command(BaseCommand):
+
+    option_list = BaseCommand.option_list + (
+        make_option('--latency', type='float', default=0.02,
+                    help='Seconds added to every request of the fake server'),
+        make_option('--error-rate', type='float', default=0.0,
+                    help='Probability of a retryable error of an API call'),
+        make_option('--files', type='int', default=500,
+                    help='Files to list and to save by batches'),
+        make_option('--uploads', type='int', default=8,
+                    help='Files to upload'),
+        make_option('--size', type='int', default=1024 * 1024,
+                    help='Size of an uploaded file in bytes'),
+        make_option('--rows', type='int', default=500,
+                    help='Worksheet rows to write, 10 cells per row'),
+        make_option('--workers', type='int', default=4,
+                    help='Concurrent uploads and cell batches'),
+        make_option('--seed', type='int', default=None,
+                    help='Seed of the injected errors'),
+    )
+
+    def handle(self, *args, **options):
+        ''' Throughput of gdrive against the local fake Google server
+            -----------------------------------------------------------
+
+        No network and no OAuth session are needed: FakeGoogle serves
+        Drive API v2 and Spreadsheets feeds on localhost, with injected
+        latency and retryable errors.
+
+        Outpute:
+        ::
+            benchmark name, items per second (count in seconds)
+
+        Usage:
+        ::
+            python manage.py gdrive_benchmark --latency 0.05 --error-rate 0.01
+        '''
+
+        fake = FakeGoogle(latency=options['latency'], error_rate=options['error_rate'],
+                          seed=options['seed'])
+        tmp = tempfile.mkdtemp()
+
+        with fake:
+            print notice(u'FakeGoogle at %s, latency: %ss, error rate: %s' % (
+                fake.url, options['latency'], options['error_rate']))
+
+            gdrive = fake.connect('benchmark')
+            folder = GFolder(gdrive, {})
+            folder.title = u'benchmark'
+            folder = folder.save()
+            count = options['files']
+            files = []
+
+            def create():
+                files.extend(create_files(gdrive, folder, count))
+
+            measure(u'batch insert', count, 'files', create)
+            measure(u'batch update', count, 'files', lambda: save_files(gdrive, files))
+            measure(u'list, 100 per page', count, 'files',
+                    lambda: list_files(gdrive, folder, count, page_size=100, prefetch=False))
+            measure(u'list, prefetch', count, 'files',
+                    lambda: list_files(gdrive, folder, count, page_size=100))
+            measure(u'list, fields projection', count, 'files',
+                    lambda: list_files(gdrive, folder, count, page_size=1000,
+                                       fields='id,title,mimeType'))
+
+            paths = []
+
+            for i in range(options['uploads']):
+                paths += [os.path.join(tmp, 'upload-%d.bin' % i)]
+
+                with open(paths[-1], 'wb') as f:
+                    f.write(os.urandom(options['size']))
+
+            megabytes = options['uploads'] * options['size'] / 1024.0 / 1024.0
+            measure(u'resumable uploads', megabytes, 'MB',
+                    lambda: upload(gdrive, folder, paths, options['workers']))
+
+            sheet = GSheet(gdrive, {})
+            sheet.title = u'benchmark'
+            sheet = sheet.save()
+            worksheet = GWorkSheet(sheet, {'title': u'benchmark', 'col_count': 10,
+                                           'row_count': options['rows']})
+            worksheet.save()
+            measure(u'bulk cells update', options['rows'] * 10, 'cells',
+                    lambda: write_cells(worksheet, options['rows'], 10, 1000,
+                                        options['workers']))
+
+            stats = gdrive.scheduler.stats()
+
+        shutil.rmtree(tmp)
+        print u"""
+        Summary:
+        --------
+            HTTP requests:    %s
+            API calls:        %s
+            injected errors:  %s
+            retries:          %s
+            failures:         %s
+        """ % (notice(force_str(fake.stats['requests'])),
+               notice(force_str(fake.stats['calls'])),
+               notice(force_str(fake.stats['errors'])),
+               notice(force_str(stats['retries'])),
+               (stats['failures'] and error or success)(force_str(stats['failures'])))
@@ -0,0 +1,402 @@
+# coding: UTF-8
+
+import os
+import shutil
+import tempfile
+import threading
+from unittest import skipIf
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from rq import Queue
+import django_rq
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from bicycle.gdrive import GDoc
+from bicycle.gdrive import GError
+from bicycle.gdrive import GFactory
+from bicycle.gdrive import GFile
+from bicycle.gdrive import GFolder
+from bicycle.gdrive import GResult
+from bicycle.gdrive import GSheet
+from bicycle.gdrive import GWorkSheet
+from bicycle.gdrive.jobs import job_status
+from bicycle.gdrive.parallel import GParallel
+from bicycle.gdrive.scheduler import Scheduler
+from bicycle.gdrive.sync import DictIndex
+from bicycle.gdrive.sync import GSync
+from bicycle.tests.fake import FakeGoogle
+from bicycle.tests.fake import INJECTED_ERRORS
+
+
+class FakeGoogleTestCase(SimpleTestCase):
+
+    ''' Tests against FakeGoogle, a server per test case '''
+
+    @classmethod
+    def setUpClass(cls):
+        super(FakeGoogleTestCase, cls).setUpClass()
+        cls.fake = FakeGoogle().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake.stop()
+        super(FakeGoogleTestCase, cls).tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.fake.error_rate = 0
+        self.fake.injected_errors = list(INJECTED_ERRORS)
+        self.gdrive = self.fake.connect()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def folder(self, title=u'folder', parent=None):
+        f = GFolder(self.gdrive, {})
+        f.title = title
+
+        if parent is not None:
+            f.parents = [{'id': parent.get_id()}]
+
+        return f.save()
+
+    def sheet(self, title=u'sheet'):
+        s = GSheet(self.gdrive, {})
+        s.title = title
+        return s.save()
+
+    def local_file(self, content, name='upload.bin'):
+        path = os.path.join(self.tmp, name)
+
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        return path
+
+    def upload(self, content, parent=None):
+        f = GFile(self.gdrive, {})
+        f.title = u'upload.bin'
+        f.mime_type = f.file_mime_type = u'application/octet-stream'
+        f.filename = self.local_file(content)
+        f.chunksize = 256 * 1024
+
+        if parent is not None:
+            f.parents = [{'id': parent.get_id()}]
+
+        return f.save()
+
+
+class GFactoryTest(FakeGoogleTestCase):
+
+    def test_filter_follows_pages(self):
+        folder = self.folder()
+
+        for i in range(5):
+            self.folder(u'child-%d' % i, folder)
+
+        q = u"'%s' in parents" % folder.get_id()
+        titles = [f.title for f in GFactory.filter(self.gdrive, page_size=2, q=q)]
+        self.assertEqual(sorted(titles), [u'child-%d' % i for i in range(5)])
+
+    def test_get_revalidates_cached_metadata(self):
+        folder = self.folder()
+        GFactory.get(self.gdrive, folder.get_id())
+        requests = self.fake.stats['requests']
+        obj = GFactory.get(self.gdrive, folder.get_id())
+
+        self.assertIsInstance(obj, GFolder)
+        self.assertEqual(obj.title, u'folder')
+        self.assertEqual(self.fake.stats['requests'], requests + 1)
+
+    def test_batch_resolves_results_on_exit(self):
+        ids = [self.folder(u'f%d' % i).get_id() for i in range(3)]
+
+        with self.gdrive.batch():
+            results = [GFactory.get(self.gdrive, id) for id in ids + ['missing']]
+            self.assertFalse(any(r.done() for r in results))
+
+        self.assertEqual([r.result().title for r in results[:3]], [u'f0', u'f1', u'f2'])
+        self.assertIsNotNone(results[3].exception())
+
+    def test_batch_belongs_to_its_thread(self):
+        folder = self.folder()
+        other = []
+
+        def get():
+            other.append(GFactory.get(self.gdrive, folder.get_id()))
+
+        with self.gdrive.batch():
+            result = GFactory.get(self.gdrive, folder.get_id())
+            thread = threading.Thread(target=get)
+            thread.start()
+            thread.join()
+
+            self.assertIsInstance(other[0], GFolder)
+            self.assertFalse(result.done())
+
+        self.assertIsInstance(result.result(), GFolder)
+
+    def test_upload_parameters_are_slots(self):
+        f = GFile(self.gdrive, {'filename': '/tmp/upload.bin'})
+        f.chunksize = 1024
+        f.file_mime_type = u'text/plain'
+
+        self.assertEqual(f.filename, '/tmp/upload.bin')
+        self.assertIsNone(f._changes)
+        self.assertEqual(f.get_raw(), {'filename': '/tmp/upload.bin'})
+        self.assertRaises(AttributeError, setattr, f, 'modified', True)
+
+    def test_mime_type_of_typed_files_is_settable(self):
+        folder = GFolder(self.gdrive, {})
+        self.assertEqual(folder.mime_type, u'application/vnd.google-apps.folder')
+
+        doc = GDoc(self.gdrive, {})
+        doc.title = u'text.txt'
+        doc.mime_type = u'text/plain'
+        self.assertEqual(doc.save().get_raw()['mimeType'], u'text/plain')
+
+    def test_parallel_wraps_errors(self):
+        folder = self.folder()
+
+        with GParallel(self.gdrive, workers=2) as p:
+            results = p.get([folder.get_id(), 'missing'])
+
+        self.assertIsInstance(results[0].result(), GFolder)
+        self.assertIsInstance(results[1].exception(), GError)
+
+
+class TransferTest(FakeGoogleTestCase):
+
+    def test_resumable_upload(self):
+        content = os.urandom(600 * 1024)
+        stats = []
+        f = GFile(self.gdrive, {})
+        f.title = u'upload.bin'
+        f.mime_type = f.file_mime_type = u'application/octet-stream'
+        f.filename = self.local_file(content)
+        f.chunksize = 256 * 1024
+        f = f.save(progress=lambda s: stats.append(s.bytes_sent))
+
+        self.assertEqual(self.fake.contents[f.get_id()], content)
+        self.assertEqual(stats, [256 * 1024, 512 * 1024, len(content)])
+
+    def test_upload_inside_of_batch_is_sent_right_away(self):
+
+        with self.gdrive.batch():
+            result = self.upload('content')
+
+        self.assertIsInstance(result, GResult)
+        self.assertEqual(self.fake.contents[result.result().get_id()], 'content')
+
+    def test_download(self):
+        content = os.urandom(3000)
+        f = self.upload(content)
+        path = f.download(os.path.join(self.tmp, 'download.bin'), chunk_size=1024)
+
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), content)
+
+        self.assertEqual(''.join(f.iter_content(start=1000)), content[1000:])
+
+    def interrupted_download(self, f, path):
+        iter_content = GFile.iter_content
+
+        def interrupted(*args, **kwargs):
+            yield next(iter_content(*args, **kwargs))
+            raise IOError('interrupted')
+
+        GFile.iter_content = interrupted
+
+        try:
+            self.assertRaises(IOError, f.download, path, chunk_size=1024, resume=True)
+        finally:
+            GFile.iter_content = iter_content
+
+        self.assertEqual(os.path.getsize(path), 1024)
+
+    def test_download_is_resumed(self):
+        content = os.urandom(3000)
+        f = self.upload(content)
+        path = os.path.join(self.tmp, 'download.bin')
+        self.interrupted_download(f, path)
+        f.download(path, chunk_size=1024, resume=True)
+
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), content)
+
+        self.assertFalse(os.path.exists(path + '.version'))
+
+    def test_download_of_changed_file_starts_again(self):
+        f = self.upload(os.urandom(3000))
+        path = os.path.join(self.tmp, 'download.bin')
+        self.interrupted_download(f, path)
+
+        content = os.urandom(1000)
+        changed = GFile(self.gdrive, f.get_raw())
+        changed.filename = self.local_file(content)
+        changed.save()
+        # the object is listed before the change
+        f.download(path, chunk_size=1024, resume=True)
+
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), content)
+
+    def test_export_follows_redirect(self):
+        doc = GDoc(self.gdrive, {})
+        doc.title = u'document'
+        doc = doc.save()
+
+        self.assertEqual(''.join(doc.iter_content('text/plain')), 'document')
+
+    def test_streams_reuse_pooled_connections(self):
+        w = self.sheet().get_worksheets()[0]
+        w.retrieve_cells()
+        connections = self.fake.stats['connections']
+
+        for i in range(3):
+            w.retrieve_cells()
+
+        self.assertEqual(self.fake.stats['connections'], connections)
+
+
+class WorksheetTest(FakeGoogleTestCase):
+
+    def test_worksheets_are_indexed(self):
+        sheet = self.sheet()
+        w = GWorkSheet(sheet, {'title': u'data', 'col_count': 5, 'row_count': 10})
+        w.save()
+        # a new object downloads the feed with the added worksheet
+        sheet = GFactory.get(self.gdrive, sheet.get_id())
+        worksheets = sheet.get_worksheets()
+
+        self.assertEqual([x.title for x in worksheets], [u'Sheet1', u'data'])
+        self.assertEqual(worksheets.get_by_id(w.get_id()).title, u'data')
+        # the feed is not downloaded again, while it is not changed
+        self.assertFalse(sheet.refresh_worksheets())
+
+    def test_worksheet_title_is_unique(self):
+        sheet = self.sheet()
+        w = GWorkSheet(sheet, {'title': u'Sheet1', 'col_count': 5, 'row_count': 10})
+        self.assertRaises(GError, w.save)
+
+    def test_update_multiple_cells(self):
+        w = self.sheet().get_worksheets()[0]
+        w.update_multiple_cells({'R1C1': u'title', 'R2C2': u'10'})
+        w.update_multiple_cells({'R1C1': u'name'})
+
+        self.assertTrue(all(r.ok for r in w.last_results))
+        cells = self.fake.sheets[w.get_file_id()]['worksheets'][w.get_id()]['cells']
+        self.assertEqual(cells[(1, 1)]['value'], u'name')
+        self.assertEqual(cells[(2, 2)]['value'], u'10')
+
+    def test_bulk_update(self):
+        w = self.sheet().get_worksheets()[0]
+        rows = [[u'%d:%d' % (r, c) for c in range(3)] for r in range(20)]
+        results = list(w.bulk_update(rows, batch_size=7, workers=2))
+
+        self.assertEqual(len(results), 60)
+        self.assertTrue(all(r.ok for r in results))
+        cells = self.fake.sheets[w.get_file_id()]['worksheets'][w.get_id()]['cells']
+        self.assertEqual(cells[(20, 3)]['value'], u'19:2')
+
+
+class SchedulerTest(FakeGoogleTestCase):
+
+    def setUp(self):
+        super(SchedulerTest, self).setUp()
+        self.scheduler = self.gdrive.scheduler = Scheduler(max_retries=2, max_users=2)
+        self.scheduler.backoff = lambda attempt: None
+
+    def test_batch_retries_are_counted(self):
+        folder = self.folder()
+        self.fake.error_rate = 1
+
+        with self.gdrive.batch():
+            result = GFactory.get(self.gdrive, folder.get_id())
+
+        self.assertIsNotNone(result.exception())
+        self.assertEqual(self.scheduler.stats()['retries'], 2)
+        self.assertEqual(self.scheduler.stats()['failures'], 1)
+
+    def test_server_errors_of_post_are_not_retried(self):
+        url = self.fake.feeds_url + '/worksheets/%s/private/full' % self.sheet().get_id()
+        self.fake.error_rate = 1
+        self.fake.injected_errors = [(503, 'backendError', 'Backend Error')]
+
+        self.assertRaises(GError, self.gdrive.request, url, 'POST', body='<entry/>')
+        self.assertEqual(self.scheduler.stats()['retries'], 0)
+
+        self.assertRaises(GError, self.gdrive.request, url)
+        self.assertEqual(self.scheduler.stats()['retries'], 2)
+
+    def test_rate_limit_errors_of_post_are_retried(self):
+        url = self.fake.feeds_url + '/worksheets/%s/private/full' % self.sheet().get_id()
+        self.fake.error_rate = 1
+        self.fake.injected_errors = [(429, 'rateLimitExceeded', 'Rate Limit Exceeded')]
+
+        self.assertRaises(GError, self.gdrive.request, url, 'POST', body='<entry/>')
+        self.assertEqual(self.scheduler.stats()['retries'], 2)
+
+    def test_user_buckets_are_evicted(self):
+
+        for user in ('a', 'b', 'c'):
+            self.scheduler.throttle(user)
+
+        self.assertEqual(len(self.scheduler.user_buckets), 2)
+
+
+class GSyncTest(FakeGoogleTestCase):
+
+    def test_full_and_incremental_sync(self):
+        root = self.folder(u'root')
+        child = self.folder(u'child', root)
+        f = self.upload('content', child)
+        outside = self.folder(u'outside')
+        index = DictIndex()
+
+        self.assertEqual(GSync(self.gdrive, index, root.get_id()).run(), 2)
+        self.assertIn(f.get_id(), index)
+
+        # a folder moved into the tree brings its content with it
+        inner = self.upload('inner', outside)
+        outside.parents = [{'id': root.get_id()}]
+        outside.save()
+        child.delete()
+
+        GSync(self.gdrive, index, root.get_id()).run()
+        self.assertNotIn(child.get_id(), index)
+        self.assertNotIn(f.get_id(), index)
+        self.assertIn(outside.get_id(), index)
+        self.assertIn(inner.get_id(), index)
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class JobStatusTest(SimpleTestCase):
+
+    def setUp(self):
+        self.queue = Queue(connection=fakeredis.FakeStrictRedis())
+        self.queue.connection.flushall()
+        get_queue = django_rq.get_queue
+        self.addCleanup(setattr, django_rq, 'get_queue', get_queue)
+        django_rq.get_queue = lambda name: self.queue
+
+    def test_status_of_user_job(self):
+        job = self.queue.enqueue_call('bicycle.gdrive.jobs.save_file', args=('{}', 'user', {}),
+                                      job_id='gdrive-save')
+
+        self.assertEqual(job_status(job.id, 'user'), {'id': job.id, 'status': 'queued'})
+        self.assertIsNone(job_status(job.id, 'other'))
+
+    def test_other_jobs_of_the_queue_are_not_found(self):
+        job = self.queue.enqueue_call('bicycle.searchextensions.jobs.update_index')
+        self.assertIsNone(job_status(job.id, 'user'))
+
+        job = self.queue.enqueue_call('bicycle.searchextensions.jobs.update_index',
+                                      job_id='gdrive-update')
+        self.assertIsNone(job_status(job.id, 'user'))
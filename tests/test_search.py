@@ -0,0 +1,291 @@
+# coding: UTF-8
+
+import codecs
+import os
+import shutil
+import tempfile
+import time
+from unittest import skipIf
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.test import TestCase
+from django.test import override_settings
+from haystack import connections
+from haystack.models import SearchResult
+from haystack.query import SearchQuerySet
+import django_rq
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from bicycle.searchextensions import indexing
+from bicycle.searchextensions import suggest
+from bicycle.searchextensions.cache import bump_generation
+from bicycle.searchextensions.cache import CachedSearchQuerySet
+from bicycle.searchextensions.cache import LRUCache
+from bicycle.searchextensions.utilites import QueryPlanner
+from bicycle.searchextensions.utilites import split_query
+
+
+class SuggestingQuerySet(SearchQuerySet):
+
+    ''' Suggests words of the suggestions dict one by one, like Xapian '''
+
+    suggestions = {}
+    calls = []
+
+    def spelling_suggestion(self, preferred_query=None):
+        self.calls.append(preferred_query)
+        return u' '.join(self.suggestions.get(w, w) for w in preferred_query.split())
+
+
+class WholeQuerySet(SuggestingQuerySet):
+
+    ''' Suggests a single phrase, not word by word '''
+
+    def spelling_suggestion(self, preferred_query=None):
+        self.calls.append(preferred_query)
+        return u'something else'
+
+
+class ListQuerySet(object):
+
+    ''' Results of a list, remembers slices asked from the backend '''
+
+    def __init__(self, results):
+        self.results = results
+        self.slices = []
+
+    def __getitem__(self, k):
+        self.slices.append((k.start, k.stop))
+        return self.results[k]
+
+    def count(self):
+        return len(self.results)
+
+
+class QueryPlannerTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.planner = QueryPlanner(maxsize=10)
+        SuggestingQuerySet.suggestions = {u'tets': u'test', u'ryby': u'рыбы'}
+        SuggestingQuerySet.calls = []
+
+    def test_split_query(self):
+        self.assertEqual(split_query(u' "big   red" fish \'\' "x'),
+                         [u'big red', u'fish', u'"x'])
+
+    def test_suggestions_are_aligned_with_parts(self):
+        plan = self.planner.plan(u'"unit tets" ryby fish', SuggestingQuerySet)
+
+        self.assertEqual(plan, ((u'unit tets', u'unit test'),
+                                (u'ryby', u'рыбы'),
+                                (u'fish', None)))
+        self.assertEqual(SuggestingQuerySet.calls, [u'unit tets ryby fish'])
+
+    def test_suggestion_not_word_by_word_is_ignored(self):
+        plan = self.planner.plan(u'"unit tets" ryby', WholeQuerySet)
+        self.assertEqual(plan, ((u'unit tets', None), (u'ryby', None)))
+
+    def test_plan_is_cached_by_generation(self):
+        self.planner.plan(u'fish  tets', SuggestingQuerySet)
+        self.planner.plan(u' fish tets ', SuggestingQuerySet)
+        self.assertEqual(len(SuggestingQuerySet.calls), 1)
+
+        bump_generation()
+        self.planner.plan(u'fish tets', SuggestingQuerySet)
+        self.assertEqual(len(SuggestingQuerySet.calls), 2)
+
+    def test_build_matches_parts_or_suggestions(self):
+        plan = ((u'tets', u'test'), (u'fish', None))
+        queryset = self.planner.build(plan, SuggestingQuerySet)
+        self.assertEqual(repr(queryset.query.query_filter),
+                         '<SQ: AND ((content__startswith=tets OR content__contains=tets OR '
+                         'content__startswith=test OR content__contains=test) AND '
+                         '(content__startswith=fish OR content__contains=fish))>')
+
+
+class CachedSearchQuerySetTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.queryset = ListQuerySet([
+            SearchResult('auth', 'user', i, 1.0 / (i + 1), title=u'user %d' % i,
+                         highlighted={'text': [u'<em>user</em> %d' % i]})
+            for i in range(5)])
+        self.hits = CachedSearchQuerySet(self.queryset, u'user', LRUCache(10))
+
+    def test_stored_fields_are_restored(self):
+        self.hits[1:3]
+        results = self.hits[1:3]
+
+        self.assertEqual(self.queryset.slices, [(1, 3)])
+        self.assertEqual([(r.pk, r.title) for r in results], [(1, u'user 1'), (2, u'user 2')])
+        self.assertEqual(results[0].highlighted, {'text': [u'<em>user</em> 1']})
+        self.assertEqual(results[0].score, 0.5)
+
+    def test_index_and_iteration(self):
+        self.assertEqual(self.hits[4].pk, 4)
+        self.assertEqual([r.pk for r in self.hits], range(5))
+        self.assertRaises(IndexError, lambda: self.hits[5])
+
+    def test_negative_indexing_is_not_supported(self):
+        self.assertRaises(AssertionError, lambda: self.hits[-1])
+        self.assertRaises(AssertionError, lambda: self.hits[-2:])
+        self.assertRaises(AssertionError, lambda: self.hits[:-1])
+
+
+class PatchMixin(object):
+
+    def patch(self, obj, name, value):
+        ''' Set the attribute for the test '''
+
+        self.addCleanup(setattr, obj, name, getattr(obj, name))
+        setattr(obj, name, value)
+
+
+class FakeQueue(object):
+
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue_call(self, func, **kwargs):
+        self.jobs.append(func)
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class IndexingTest(PatchMixin, SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.conn = fakeredis.FakeStrictRedis()
+        self.conn.flushall()
+        self.queue = FakeQueue()
+        self.patch(indexing, 'get_connection', lambda: self.conn)
+        self.patch(django_rq, 'get_queue', lambda name: self.queue)
+        self.patch(indexing, 'REBUILD_WAIT', 0)
+
+    def test_busy_rebuild_is_scheduled_by_lock_holder(self):
+        results = []
+        self.patch(indexing, 'index_identifiers',
+                   lambda identifiers, using: results.append(indexing.rebuild()))
+        indexing.schedule_rebuild()
+        indexing.record(['auth.user.1'])
+        self.queue.jobs = []
+
+        # the rebuild job runs while the queue is processed
+        self.assertEqual(indexing.process_queue(), 1)
+        self.assertEqual(results, [None])
+        self.assertEqual(self.queue.jobs, [indexing.REBUILD_JOB])
+        self.assertIsNone(self.conn.get(indexing.REBUILD_PENDING_KEY))
+
+
+class UserIndex(object):
+
+    def build_queryset(self, using=None):
+        return User.objects.all()
+
+
+class ListBackend(object):
+
+    def __init__(self):
+        self.pks = []
+
+    def update(self, index, objects):
+        self.pks += [obj.pk for obj in objects]
+
+
+class EventQueue(list):
+    put = list.append
+
+
+class BuildTest(PatchMixin, TestCase):
+
+    def setUp(self):
+        User.objects.bulk_create([User(username=u'user%d' % i) for i in range(5)])
+        self.backend = ListBackend()
+        unified_index = connections['default'].get_unified_index()
+        self.patch(unified_index, 'get_indexes', lambda: {User: UserIndex()})
+        self.patch(unified_index, 'get_index', lambda model: UserIndex())
+        self.patch(indexing, 'shadow_backend', lambda path, using: self.backend)
+
+    def test_build_all_reports_every_batch(self):
+        events = []
+        counts = indexing.build_all(self.backend, batch_size=2, progress=events.append)
+
+        self.assertEqual(counts, {'auth.user': 5})
+        self.assertEqual([(e['shard'], e['model'], e['count'], e['done']) for e in events],
+                         [(None, 'auth.user', 2, False), (None, 'auth.user', 4, False),
+                          (None, 'auth.user', 5, False), (None, 'auth.user', 5, True)])
+
+    def test_shard_reports_every_batch_to_the_queue(self):
+        pks = list(User.objects.order_by('pk').values_list('pk', flat=True))
+        events = EventQueue()
+        self.patch(indexing, '_events', events)
+
+        count = indexing._build_shard(('auth.user', pks[0], None, '/tmp/shards/0001',
+                                       'default', 3))
+
+        self.assertEqual(count, 4)
+        self.assertEqual(self.backend.pks, pks[1:])
+        self.assertEqual([(e['shard'], e['start'], e['count'], e['done']) for e in events],
+                         [('0001', pks[0], 3, False), ('0001', pks[0], 4, False),
+                          ('0001', pks[0], 4, True)])
+
+
+class SuggestTest(PatchMixin, SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'index.suggest')
+        self.settings = override_settings(SEARCH_SUGGEST_PATH=self.path)
+        self.settings.enable()
+        self.builds = []
+        self.patch(suggest, 'build', lambda using: self.builds.append(using))
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tmp)
+
+    def write(self, terms, mtime):
+
+        with codecs.open(self.path, 'w', 'utf-8') as f:
+            for term, weight in terms:
+                f.write(u'%s\t%d\n' % (term, weight))
+
+        os.utime(self.path, (mtime, mtime))
+
+    def test_build_if_stale(self):
+        # the file is built by xapian bindings
+        self.patch(suggest, 'xapian', object())
+        suggest.build_if_stale(interval=60)
+        self.write([], time.time())
+        suggest.build_if_stale(interval=60)
+        self.write([], time.time() - 61)
+        suggest.build_if_stale(interval=60)
+
+        self.assertEqual(self.builds, ['default', 'default'])
+
+    def test_changed_file_is_loaded_in_background(self):
+        now = time.time()
+        self.write([(u'bike', 30), (u'bicycle', 12)], now - 10)
+        index = suggest.get_index()
+        self.assertEqual(suggest.suggest(u'red bi'), [u'red bike', u'red bicycle'])
+
+        self.write([(u'bicycle', 40)], now)
+        # the loaded index answers, while the file is loaded again
+        self.assertIs(suggest.get_index(), index)
+
+        for i in range(100):
+            if suggest.get_index() is not index:
+                break
+
+            time.sleep(0.01)
+
+        self.assertEqual(suggest.suggest(u'bi'), [u'bicycle'])
+        self.assertNotIn(self.path, suggest._reloading)